@@ -14,25 +14,102 @@
 # under the License.
 
 
+import collections
+import time
+
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet
-from ryu.lib.packet import ethernet
-from ryu.lib.packet import ipv4
-from ryu.lib.packet import arp
 from ryu.ofproto import ether
 
+# A dirty workaround to import the port statistics telemetry, the options, the packet-in parser, the
+# flow-mod batching, the event log and the warm restart from lab3
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lab3'))
+from port_stats import PortStatsMonitor
+from routing_config import CONF
+import packet_parser
+from flow_mods import FlowModBatcher
+from event_log import EventLog
+from warm_restart import WarmRestart
+
+
+# MAC table of one switch. Addresses not seen for aging_time seconds are forgotten, and once it
+# holds size addresses the least recently seen one makes room for a new one. 0 turns either off.
+class MacTable:
+    def __init__(self, size, aging_time):
+        self.size = size
+        self.aging_time = aging_time
+        # mac -> (port, time last seen), least recently seen first
+        self.entries = collections.OrderedDict()
+
+    # Learn that mac is behind port. Returns the port it was behind before if it moved, and the
+    # addresses evicted to make room for it.
+    def learn(self, mac, port, now):
+        self.expire(now)
+        old = self.entries.pop(mac, None)
+        self.entries[mac] = (port, now)
+        evicted = []
+        while 0 < self.size < len(self.entries):
+            evicted.append(self.entries.popitem(last=False)[0])
+        return (old[0] if old is not None and old[0] != port else None), evicted
+
+    # Port of mac, None when it is not known or aged out
+    def port(self, mac, now):
+        entry = self.entries.get(mac)
+        if entry is None:
+            return None
+        if self.aging_time > 0 and now - entry[1] >= self.aging_time:
+            del self.entries[mac]
+            return None
+        return entry[0]
+
+    def expire(self, now):
+        while self.aging_time > 0 and self.entries and now - next(iter(self.entries.values()))[1] >= self.aging_time:
+            self.entries.popitem(last=False)
+
+    def items(self):
+        return ((mac, port) for mac, (port, _) in self.entries.items())
+
+
 class LearningSwitch(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _CONTEXTS = {'port_stats': PortStatsMonitor}
 
     def __init__(self, *args, **kwargs):
         super(LearningSwitch, self).__init__(*args, **kwargs)
+        self.port_stats = kwargs['port_stats']
+        self.flow_mods = FlowModBatcher()
+        self.event_log = EventLog('LearningSwitch')
 
-        # Initialize mac address table
+        # Initialize mac address table, a MacTable per dpid. The entries towards an address idle out
+        # after the aging time of the table, on the switch as in the controller.
         self.mac_to_port = {}
+        self.mac_table_size = CONF.routing.mac_table_size
+        self.mac_aging_time = CONF.routing.mac_aging_time
+        self.warm_restart = WarmRestart('LearningSwitch', self.flow_mods, self.event_log, self.learned_state)
+        if self.warm_restart.state is not None:
+            now = time.monotonic()
+            for dpid, table in self.warm_restart.state['mac_to_port'].items():
+                for mac, port in table.items():
+                    self.mac_table(int(dpid)).learn(mac, port, now)
+
+    def mac_table(self, dpid):
+        table = self.mac_to_port.get(dpid)
+        if table is None:
+            table = self.mac_to_port[dpid] = MacTable(self.mac_table_size, self.mac_aging_time)
+        return table
+
+    # MAC tables kept by warm_restart over a restart, they age from the restart on
+    def learned_state(self):
+        return {'mac_to_port': {str(dpid): dict(table.items()) for dpid, table in self.mac_to_port.items()}}
+
+    def stop(self):
+        self.warm_restart.save()
+        super(LearningSwitch, self).stop()
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
@@ -40,23 +117,54 @@ class LearningSwitch(app_manager.RyuApp):
         datapath = ev.msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
+        self.warm_restart.switch_connected(datapath)
 
         # Initial flow entry for matching misses
         match = parser.OFPMatch()
         actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
                                           ofproto.OFPCML_NO_BUFFER)]
         self.add_flow(datapath, 0, match, actions)
+        self.flow_mods.flush()
 
     # Add a flow entry to the flow-table
-    def add_flow(self, datapath, priority, match, actions):
+    def add_flow(self, datapath, priority, match, actions, idle_timeout=0, hard_timeout=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         # Construct flow_mod message and send it
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
         mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                match=match, instructions=inst)
-        datapath.send_msg(mod)
+                                match=match, instructions=inst,
+                                idle_timeout=idle_timeout, hard_timeout=hard_timeout)
+        self.flow_mods.send(datapath, mod)
+
+    # Delete the flow entries towards a MAC address that moved or was evicted
+    def delete_flows(self, datapath, mac):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE, out_port=ofproto.OFPP_ANY,
+                                out_group=ofproto.OFPG_ANY, match=parser.OFPMatch(eth_dst=mac))
+        self.flow_mods.send(datapath, mod)
+
+    # Entry towards mac_dest out of out_port, for packets coming in on in_port
+    def add_mac_flow(self, datapath, in_port, mac_dest, out_port):
+        parser = datapath.ofproto_parser
+        # The port towards a learned address does not depend on where the packet came from
+        if CONF.routing.aggregate_flows:
+            match = parser.OFPMatch(eth_dst=mac_dest)
+        else:
+            match = parser.OFPMatch(in_port=in_port, eth_dst=mac_dest)
+        self.add_flow(datapath, 1, match, [parser.OFPActionOutput(out_port)], self.mac_aging_time,
+                      CONF.routing.flow_hard_timeout)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, ev):
+        self.warm_restart.flow_stats_reply(ev.msg)
+        self.flow_mods.flush()
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        self.warm_restart.flow_removed(ev.msg)
 
     # Handle the packet_in event
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
@@ -69,37 +177,50 @@ class LearningSwitch(app_manager.RyuApp):
 
         # Get datapath ID to identify the switch
         dpid = datapath.id
-        self.mac_to_port.setdefault(dpid, {})
+        table = self.mac_table(dpid)
+        now = time.monotonic()
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
+        pkt = packet_parser.parse(msg.data)
+        if pkt is None:
+            return
 
-        mac_src = eth.src
-        mac_dest = eth.dst
+        mac_src = pkt.eth_src
+        mac_dest = pkt.eth_dst
         in_port = msg.match['in_port']
-        pkt_arp = pkt.get_protocol(arp.arp)
-
-        self.mac_to_port[dpid][mac_src] = in_port
 
-        if mac_dest in self.mac_to_port[dpid]:
-            out_port = self.mac_to_port[dpid][mac_dest]
-        else:
+        # Group addresses are not learned. The entries towards an address that moved or was evicted
+        # are deleted, they would send its frames to the wrong port.
+        if not int(mac_src[:2], 16) & 1:
+            moved_from, evicted = table.learn(mac_src, in_port, now)
+            if moved_from is not None:
+                self.event_log.info('mac_moved', 'switch=%s mac=%s from_port=%s to_port=%s', dpid, mac_src,
+                                    moved_from, in_port)
+                self.delete_flows(datapath, mac_src)
+            for mac in evicted:
+                self.event_log.debug('mac_evicted', 'switch=%s mac=%s', dpid, mac)
+                self.delete_flows(datapath, mac)
+
+        out_port = table.port(mac_dest, now)
+        if out_port is None:
             out_port = ofproto.OFPP_FLOOD
 
         actions = [parser.OFPActionOutput(out_port)]
 
-        is_arp = False
-        if pkt_arp:
-            is_arp = True
+        is_arp = pkt.ethertype == ether.ETH_TYPE_ARP
 
+        # Both ends are known, so the entries of both directions go in at once and the reply does
+        # not come to the controller again
         if out_port != ofproto.OFPP_FLOOD and not is_arp:
-            match = parser.OFPMatch(in_port=in_port, eth_dst=mac_dest)
-            self.add_flow(datapath, 1, match, actions)
-        
-        print("Switch: {}, {} -> {}, In Port: {}, out_port: {}, ARP: {}".format(dpid, mac_src, mac_dest, in_port, out_port, is_arp))
+            self.add_mac_flow(datapath, in_port, mac_dest, out_port)
+            if table.port(mac_src, now) == in_port:
+                self.add_mac_flow(datapath, out_port, mac_src, in_port)
+
+        self.event_log.debug('packet_in', 'switch=%s src=%s dst=%s in_port=%s out_port=%s arp=%s', dpid, mac_src,
+                             mac_dest, in_port, out_port, is_arp)
 
         out = parser.OFPPacketOut(datapath=datapath,
                                 buffer_id=ofproto.OFP_NO_BUFFER,
                                 in_port=in_port, actions=actions,
                                 data=msg.data)
-        datapath.send_msg(out)
+        self.flow_mods.send(datapath, out)
+        self.flow_mods.flush()
@@ -0,0 +1,225 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import argparse
+import contextlib
+import json
+import os
+import random
+import time
+import tracemalloc
+
+import fat_tree
+import jellyfish
+import reproduce_1c
+import reproduce_9
+import topo
+
+DEFAULT_SCALES = [8, 14, 24, 48]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+# Jellyfish built from the same equipment as a fat-tree with k ports per switch
+def jellyfish_size(k):
+    return (k ** 3) // 4, (5 * k ** 2) // 4, k
+
+
+def quiet(fn, *args):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return fn(*args)
+
+
+def fat_tree_nodes(k):
+    ft_topo = quiet(fat_tree.Fattree, k)
+    return ft_topo.CoreSwitches + ft_topo.AggSwitches + ft_topo.EdgeSwitches + ft_topo.Servers
+
+
+def jellyfish_nodes(k, seed=45):
+    jf_topo = quiet(jellyfish.Jellyfish, *jellyfish_size(k), seed)
+    return jf_topo.switches + jf_topo.servers
+
+
+def sample_server_pairs(adj, num_pairs, seed=0):
+    servers = [node for node in adj if node.startswith('sv')]
+    rand = random.Random(seed)
+    return [tuple(rand.sample(servers, 2)) for _ in range(num_pairs)]
+
+
+# Every benchmark has a setup that is not measured and returns the callable that is.
+# max_k bounds the scales it is run at, since some of them are quadratic in the number of servers.
+def bench_random_regular_graph(k, options):
+    _, num_switches, num_ports = jellyfish_size(k)
+    degree = num_ports // 2 + (num_ports // 2) % 2
+    return lambda: topo.generate_random_regular_graph_edges(degree, num_switches, seed=random.Random(45))
+
+
+def bench_jellyfish(k, options):
+    return lambda: jellyfish_nodes(k)
+
+
+def bench_fat_tree(k, options):
+    return lambda: fat_tree_nodes(k)
+
+
+def bench_tree_adj(k, options):
+    nodes = fat_tree_nodes(k)
+    return lambda: reproduce_1c.generate_tree_adj(nodes)
+
+
+def bench_bfs_fat_tree(k, options):
+    adj = reproduce_1c.generate_tree_adj(fat_tree_nodes(k))
+    pairs = sample_server_pairs(adj, options.pairs)
+    return lambda: [reproduce_1c.bfs_shortest_path(adj, a, b) for a, b in pairs]
+
+
+def bench_bfs_jellyfish(k, options):
+    adj = reproduce_1c.generate_tree_adj(jellyfish_nodes(k))
+    pairs = sample_server_pairs(adj, options.pairs)
+    return lambda: [reproduce_1c.bfs_shortest_path(adj, a, b) for a, b in pairs]
+
+
+def bench_compute_results(k, options):
+    adj = reproduce_1c.generate_tree_adj(fat_tree_nodes(k))
+    return lambda: quiet(reproduce_1c.compute_results, adj)
+
+
+def bench_ksp(k, options):
+    adj = reproduce_1c.generate_tree_adj(jellyfish_nodes(k))
+    pairs = sample_server_pairs(adj, options.ksp_pairs)
+    return lambda: [reproduce_9.lee_algorithm_k_shorthest_paths(reproduce_9.K, adj, a, b) for a, b in pairs]
+
+
+BENCHMARKS = [
+    ('generate_random_regular_graph_edges', bench_random_regular_graph, 48),
+    ('jellyfish', bench_jellyfish, 24),
+    ('fat_tree', bench_fat_tree, 48),
+    ('generate_tree_adj', bench_tree_adj, 48),
+    ('bfs_shortest_path[fat_tree]', bench_bfs_fat_tree, 24),
+    ('bfs_shortest_path[jellyfish]', bench_bfs_jellyfish, 24),
+    ('compute_results[fat_tree]', bench_compute_results, 8),
+    ('lee_algorithm_k_shorthest_paths', bench_ksp, 14),
+]
+
+
+def measure(setup, k, options):
+    run = setup(k, options)
+
+    times = []
+    for _ in range(options.repeat):
+        start_time = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start_time)
+
+    # Peak memory is measured in a separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': min(times), 'peak_bytes': peak}
+
+
+def run_benchmarks(options):
+    results = {}
+    for name, setup, max_k in BENCHMARKS:
+        if options.only and not any(selected in name for selected in options.only):
+            continue
+        for k in options.scales:
+            if k > max_k and not options.all_scales:
+                continue
+            key = f'{name}@k={k}'
+            results[key] = measure(setup, k, options)
+            print(f'{key:<48} {results[key]["seconds"]:>10.4f} s {results[key]["peak_bytes"] / 2 ** 20:>10.2f} MiB')
+    return results
+
+
+# Report every benchmark that got slower or used more memory than the baseline allows
+# Differences below min_seconds are timer noise and are ignored
+def compare_with_baseline(results, baseline, tolerance, min_seconds):
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            old, new = baseline[key][metric], result[metric]
+            if metric == 'seconds' and new - old < min_seconds:
+                continue
+            if old > 0 and new > old * (1 + tolerance):
+                regressions.append((key, metric, old, new))
+
+    for key, metric, old, new in regressions:
+        print(f'REGRESSION {key} {metric}: {old:.4f} -> {new:.4f} ({(new / old - 1) * 100:.1f}% worse)')
+    if not regressions:
+        print('No regressions against the baseline')
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark topology generation and path metrics')
+
+    parser.add_argument('-k', '--scales', dest='scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help='Fat-tree port counts to run at, Jellyfish uses the same equipment')
+
+    parser.add_argument('--only', dest='only', nargs='+', default=None,
+                        help='Only run benchmarks whose name contains one of these strings')
+
+    parser.add_argument('--all-scales', dest='all_scales', action='store_true',
+                        help='Ignore the per-benchmark scale limits')
+
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                        help='Timed runs per benchmark, the best one is reported')
+
+    parser.add_argument('--pairs', dest='pairs', type=int, default=200,
+                        help='Server pairs sampled for the BFS benchmarks')
+
+    parser.add_argument('--ksp-pairs', dest='ksp_pairs', type=int, default=10,
+                        help='Server pairs sampled for the k-shortest-paths benchmark')
+
+    parser.add_argument('-b', '--baseline', dest='baseline', default=DEFAULT_BASELINE,
+                        help='JSON file with the stored baseline results')
+
+    parser.add_argument('--save-baseline', dest='save_baseline', action='store_true',
+                        help='Store the results as the new baseline instead of comparing against it')
+
+    parser.add_argument('-t', '--tolerance', dest='tolerance', type=float, default=0.25,
+                        help='Allowed relative slowdown before a result counts as a regression')
+
+    parser.add_argument('--min-seconds', dest='min_seconds', type=float, default=0.01,
+                        help='Slowdowns smaller than this many seconds are never reported')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    benchmark_results = run_benchmarks(args)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(benchmark_results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'Saved baseline to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored_baseline = json.load(f)
+        if compare_with_baseline(benchmark_results, stored_baseline, args.tolerance, args.min_seconds):
+            exit(1)
+    else:
+        print(f'No baseline at {args.baseline}, run with --save-baseline to create one')
@@ -1,13 +1,15 @@
+import sys
+
 from topo import Node, draw_topology
 
 
 class Fattree:
-    CoreSwitches = []
-    AggSwitches = []
-    EdgeSwitches = []
-    Servers = []
 
     def __init__(self, num_ports):
+        self.CoreSwitches = []
+        self.AggSwitches = []
+        self.EdgeSwitches = []
+        self.Servers = []
         self.pod = num_ports
         self.numCore = (num_ports // 2) ** 2
         self.numAgg = (num_ports ** 2) // 2
@@ -120,6 +122,6 @@ class Fattree:
 if __name__ == '__main__':
     tree = Fattree(8)
     all_nodes = tree.CoreSwitches + tree.AggSwitches + tree.EdgeSwitches + tree.Servers
-    draw_topology(all_nodes)
+    draw_topology(all_nodes, sys.argv[1] if len(sys.argv) > 1 else None)
 
 
@@ -1,4 +1,5 @@
 import random
+import sys
 
 from topo import Node, generate_random_regular_graph_edges, draw_topology, NetworkError
 
@@ -70,4 +71,4 @@ class Jellyfish:
 if __name__ == '__main__':
     random_value = random.randint(0, 300)
     jellyfish = Jellyfish(80, 20, 8, random_value)
-    draw_topology(jellyfish.switches)
\ No newline at end of file
+    draw_topology(jellyfish.switches, sys.argv[1] if len(sys.argv) > 1 else None)
\ No newline at end of file
@@ -0,0 +1,262 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import cProfile
+import glob
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+# The mode and the worker output directory are passed through the environment so that
+# pool and process workers pick them up no matter how they are started
+PROFILE_ENV = 'LAB2_PROFILE'
+PROFILE_DIR_ENV = 'LAB2_PROFILE_DIR'
+
+# off: spans are timed and summarised on stdout only, the span files of the workers are removed
+# spans: the spans are also written as a JSON trace and a collapsed-stack file
+# cprofile: workers and the main process also run under cProfile
+# tracemalloc: spans also record memory growth, workers their peak memory
+PROFILE_MODES = ['off', 'spans', 'cprofile', 'tracemalloc']
+
+_spans = []
+_open_spans = []
+_main_profiler = None
+
+
+def profile_mode():
+    return os.environ.get(PROFILE_ENV, 'off')
+
+
+def profile_dir():
+    return os.environ.get(PROFILE_DIR_ENV, os.getcwd())
+
+
+# Workers always leave their spans in the directory, so that the summary covers every process.
+# What earlier runs left there is removed, it would be merged into the reports of this one.
+def configure(mode, directory):
+    os.environ[PROFILE_ENV] = mode
+    os.environ[PROFILE_DIR_ENV] = directory
+    os.makedirs(directory, exist_ok=True)
+    _remove_worker_files()
+
+
+def _worker_files():
+    return glob.glob(os.path.join(profile_dir(), 'spans-*.json')) + \
+        glob.glob(os.path.join(profile_dir(), 'worker-*.prof'))
+
+
+def _remove_worker_files():
+    for path in _worker_files():
+        os.remove(path)
+
+
+# Start profiling the main process, workers are handled by ProfiledWorker
+def start():
+    global _main_profiler
+    mode = profile_mode()
+    if mode == 'cprofile':
+        _main_profiler = cProfile.Profile()
+        _main_profiler.enable()
+    elif mode == 'tracemalloc':
+        tracemalloc.start()
+
+
+@contextmanager
+def span(name, **args):
+    _open_spans.append(name)
+    stack = ';'.join(_open_spans)
+    memory_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+    start_time = time.time()
+    start_counter = time.perf_counter()
+    try:
+        yield args
+    finally:
+        duration = time.perf_counter() - start_counter
+        if memory_before is not None:
+            args['memory_growth_bytes'] = tracemalloc.get_traced_memory()[0] - memory_before
+        _open_spans.pop()
+        _spans.append({'name': name, 'stack': stack, 'pid': os.getpid(), 'start': start_time,
+                       'duration': duration, 'args': args})
+
+
+# Forked workers inherit the spans of the parent, only the ones of this process are theirs
+def _own_spans():
+    pid = os.getpid()
+    return [s for s in _spans if s['pid'] == pid]
+
+
+def _flush_worker_spans():
+    path = os.path.join(profile_dir(), f'spans-{os.getpid()}-{time.perf_counter_ns()}.json')
+    with open(path, 'w') as f:
+        json.dump(_own_spans(), f)
+    _spans.clear()
+
+
+# Wraps a pool or process target so that it runs inside a span and, depending on the
+# mode, under cProfile or tracemalloc. Results are left in the profile directory.
+class ProfiledWorker:
+    def __init__(self, fn, name):
+        self.fn = fn
+        self.name = name
+
+    def __call__(self, *args):
+        mode = profile_mode()
+        profiler = None
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif mode == 'tracemalloc':
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            tracemalloc.start()
+
+        try:
+            with span(self.name) as span_args:
+                return self.fn(*args)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(profile_dir(), f'worker-{os.getpid()}-{time.perf_counter_ns()}.prof'))
+            if mode == 'tracemalloc':
+                span_args['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            _flush_worker_spans()
+
+
+def _collect_spans():
+    spans = _own_spans()
+    for path in glob.glob(os.path.join(profile_dir(), 'spans-*.json')):
+        with open(path) as f:
+            spans.extend(json.load(f))
+    return spans
+
+
+def print_summary():
+    totals = defaultdict(lambda: [0, 0.0])
+    for s in _collect_spans():
+        totals[s['name']][0] += 1
+        totals[s['name']][1] += s['duration']
+
+    print('\nTime per phase (summed over all processes):')
+    for name, (count, duration) in sorted(totals.items(), key=lambda kv: -kv[1][1]):
+        print(f'  {name:<24} {count:>6} calls {duration:>12.3f} s')
+
+
+# Chrome trace event format, loadable in chrome://tracing or Perfetto
+def _write_trace(spans, path):
+    origin = min((s['start'] for s in spans), default=0)
+    events = [{'name': s['name'], 'ph': 'X', 'pid': s['pid'], 'tid': s['pid'],
+               'ts': (s['start'] - origin) * 1e6, 'dur': s['duration'] * 1e6, 'args': s['args']}
+              for s in spans]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def _span_stacks(spans):
+    totals = defaultdict(float)
+    for s in spans:
+        totals[s['stack']] += s['duration']
+
+    # Self time of a span is its duration minus that of the spans nested in it
+    self_times = dict(totals)
+    for stack, duration in totals.items():
+        parent = stack.rpartition(';')[0]
+        if parent in self_times:
+            self_times[parent] -= duration
+    return {stack: max(duration, 0.0) for stack, duration in self_times.items()}
+
+
+def _function_label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+# cProfile only keeps caller/callee pairs, so full stacks are rebuilt by walking down from the
+# roots and splitting the time of every function over its callers in proportion to the calls.
+# Branches carrying less than min_seconds are dropped, the number of paths grows exponentially otherwise.
+def _profile_stacks(stats, max_depth=64, min_seconds=1e-4):
+    callees = defaultdict(list)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller in callers:
+            callees[caller].append(func)
+
+    stacks = defaultdict(float)
+
+    def walk(func, path, on_path, scale):
+        _, _, self_time, cumulative_time, _ = stats.stats[func]
+        stacks[';'.join(path)] += self_time * scale
+        if len(path) >= max_depth:
+            return
+        for callee in callees[func]:
+            if callee in on_path:
+                continue
+            callee_cumulative = stats.stats[callee][3]
+            via_func = stats.stats[callee][4][func][3]
+            if callee_cumulative <= 0 or via_func * scale < min_seconds:
+                continue
+            on_path.add(callee)
+            walk(callee, path + [_function_label(callee)], on_path, scale * via_func / callee_cumulative)
+            on_path.remove(callee)
+
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            walk(func, [_function_label(func)], {func}, 1.0)
+    return stacks
+
+
+def _write_collapsed(stacks, path):
+    with open(path, 'w') as f:
+        for stack, seconds in sorted(stacks.items()):
+            microseconds = int(seconds * 1e6)
+            if microseconds > 0:
+                f.write(f'{stack} {microseconds}\n')
+
+
+# Merge what the main process and all workers recorded and write <base>.trace.json and
+# <base>.folded (flamegraph.pl / speedscope input), plus <base>.prof in cprofile mode
+def write_reports(base):
+    if _main_profiler is not None:
+        _main_profiler.disable()
+
+    print_summary()
+    if profile_mode() == 'off':
+        _remove_worker_files()
+        try:
+            os.rmdir(profile_dir())
+        except OSError:
+            pass
+        return
+
+    spans = _collect_spans()
+    _write_trace(spans, base + '.trace.json')
+
+    profiles = glob.glob(os.path.join(profile_dir(), 'worker-*.prof'))
+    if _main_profiler is not None:
+        stats = pstats.Stats(_main_profiler)
+        for path in profiles:
+            stats.add(path)
+        stats.dump_stats(base + '.prof')
+        _write_collapsed(_profile_stacks(stats), base + '.folded')
+    else:
+        _write_collapsed(_span_stacks(spans), base + '.folded')
+
+    print(f'Wrote profiling reports to {base}.*')
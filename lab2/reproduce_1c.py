@@ -15,6 +15,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 import argparse
+import os
 import random
 import time
 from functools import partial
@@ -22,6 +23,7 @@ from functools import partial
 import fat_tree
 import matplotlib.pyplot as plt
 import numpy as np
+import profiling
 
 # Same setup for Jellyfish and Fattree
 import jellyfish
@@ -89,7 +91,7 @@ def compute_results(nodeDict):
     return values
 
 
-def plot_results(topo_1_values, topo_2_values):
+def plot_results(topo_1_values, topo_2_values, output=None):
     #plot the results
     labels = ['2', '3', '4', '5', '6']
 
@@ -124,23 +126,31 @@ def plot_results(topo_1_values, topo_2_values):
 
     fig.tight_layout()
 
-    plt.show()
+    if output:
+        fig.savefig(output)
+    else:
+        plt.show()
 
 
 def generate_1c_fat_tree(nr_ports, shared_list):
-    ft_topo = fat_tree.Fattree(nr_ports)
-    allNodes = ft_topo.CoreSwitches + ft_topo.AggSwitches + ft_topo.EdgeSwitches + ft_topo.Servers
-    nodeDict = generate_tree_adj(allNodes)
-    results = compute_results(nodeDict)
-    shared_list.extend(results)
+    with profiling.span('generation'):
+        ft_topo = fat_tree.Fattree(nr_ports)
+        allNodes = ft_topo.CoreSwitches + ft_topo.AggSwitches + ft_topo.EdgeSwitches + ft_topo.Servers
+        nodeDict = generate_tree_adj(allNodes)
+    with profiling.span('bfs'):
+        results = compute_results(nodeDict)
+    with profiling.span('ipc'):
+        shared_list.extend(results)
 
 
 def generate_1c_jellyfish(nr_servers, nr_switches, nr_ports, seed_value):
     print(nr_servers, nr_switches, nr_ports, seed_value)
-    jf_topo = jellyfish.Jellyfish(nr_servers, nr_switches, nr_ports, seed_value)
-    allNodes = jf_topo.switches + jf_topo.servers
-    nodeDict = generate_tree_adj(allNodes)
-    return compute_results(nodeDict)
+    with profiling.span('generation'):
+        jf_topo = jellyfish.Jellyfish(nr_servers, nr_switches, nr_ports, seed_value)
+        allNodes = jf_topo.switches + jf_topo.servers
+        nodeDict = generate_tree_adj(allNodes)
+    with profiling.span('bfs'):
+        return compute_results(nodeDict)
 
 
 def parse_args():
@@ -158,9 +168,24 @@ def parse_args():
     parser.add_argument('-r', '--repetitions', dest='repetitions', required=False, type=int, default=10,
                         help='Number of repetitions for the jellyfish experiment')
 
+    parser.add_argument('-o', '--output', dest='output', required=False, default=None,
+                        help='Save the plot to this file instead of showing it, profiling reports are written '
+                             'next to it')
+
+    parser.add_argument('--profile', dest='profile', required=False, choices=profiling.PROFILE_MODES,
+                        default=profiling.profile_mode(),
+                        help='Profiling mode, defaults to the LAB2_PROFILE environment variable or off')
+
     return parser.parse_args()
 
 
+# Profiling reports go next to the saved plot, or to the working directory when the plot is only shown
+def profiling_base(output, script_name):
+    if output:
+        return os.path.splitext(output)[0]
+    return os.path.join(os.getcwd(), script_name)
+
+
 if __name__ == '__main__':
     start_time = time.time()
 
@@ -168,24 +193,34 @@ if __name__ == '__main__':
     print(f'Reproducing figure 1c for the following configuration: Servers: {args.servers}, Switches: {args.switches}, '
           f'Ports: {args.ports}, Jellyfish repetitions: {args.repetitions}')
 
+    report_base = profiling_base(args.output, 'reproduce_1c')
+    profiling.configure(args.profile, report_base + '.profile')
+    profiling.start()
+
     manager = Manager()
     ft_results_list = manager.list()
 
-    ft_process = Process(target=generate_1c_fat_tree, args=(args.ports, ft_results_list))
+    ft_process = Process(target=profiling.ProfiledWorker(generate_1c_fat_tree, 'fat_tree'),
+                         args=(args.ports, ft_results_list))
     ft_process.start()
 
     seed_values = [random.randint(0, 300) for _ in range(0, args.repetitions)]
     jellyfish_args = [(args.servers, args.switches, args.ports, seed_value) for seed_value in seed_values]
 
-    with Pool(args.repetitions) as p:
-        results_multiple_runs_jellyfish = p.starmap(generate_1c_jellyfish, jellyfish_args)
+    with profiling.span('jellyfish_pool'):
+        with Pool(args.repetitions) as p:
+            results_multiple_runs_jellyfish = p.starmap(profiling.ProfiledWorker(generate_1c_jellyfish, 'jellyfish'),
+                                                        jellyfish_args)
 
     average_jellyfish_results = list(map(lambda x: x / args.repetitions, [sum(x) for x in zip(*results_multiple_runs_jellyfish)]))
 
-    ft_process.join()
+    with profiling.span('fat_tree_wait'):
+        ft_process.join()
     end_time = time.time()
     print(f"Total duration: {end_time-start_time} seconds")
-    plot_results(ft_results_list, average_jellyfish_results)
+    with profiling.span('plotting'):
+        plot_results(list(ft_results_list), average_jellyfish_results, args.output)
+    profiling.write_reports(report_base)
 
 
 
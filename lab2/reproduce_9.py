@@ -18,6 +18,7 @@ import random
 from itertools import count
 import matplotlib.pyplot as plt
 
+import profiling
 import topo
 import jellyfish
 import reproduce_1c
@@ -51,11 +52,13 @@ def topo_add_edge(topo, left_node, right_node):
 def lee_algorithm_multiple_paths(k, paths_to_calculate, topo, queue):
     all_paths = {}
 
-    for start_node, end_node in paths_to_calculate:
-        lengths, paths = lee_algorithm_k_shorthest_paths(k, topo, start_node, end_node)
-        all_paths[(start_node, end_node)] = paths
+    with profiling.span('ksp'):
+        for start_node, end_node in paths_to_calculate:
+            lengths, paths = lee_algorithm_k_shorthest_paths(k, topo, start_node, end_node)
+            all_paths[(start_node, end_node)] = paths
 
-    queue.put(all_paths)
+    with profiling.span('ipc'):
+        queue.put(all_paths)
 
 
 def lee_algorithm_k_shorthest_paths(k, topo, start_node, end_node):
@@ -141,14 +144,16 @@ def compute_all_k_shortest_paths(k, topo, parallelism, server_pairs):
     processes = []
     for i in range(0, parallelism):
         q = Queue()
-        p = Process(target=lee_algorithm_multiple_paths, args=(k, chunks[i], topo_copy, q))
+        p = Process(target=profiling.ProfiledWorker(lee_algorithm_multiple_paths, 'ksp_worker'),
+                    args=(k, chunks[i], topo_copy, q))
         p.start()
         processes.append((p, q))
 
     all_ksp = {}
     for p, q in processes:
-        p.join()
-        computed_dict = q.get()
+        with profiling.span('ipc'):
+            p.join()
+            computed_dict = q.get()
         print(f'Computed ksp dict of size: {len(computed_dict)}')
         all_ksp.update(computed_dict)
 
@@ -193,7 +198,7 @@ def get_path_counts(all_ksp, traffic_matrix, all_links, all_servers):
     return counts
 
 
-def assemble_histogram(path_counts):
+def assemble_histogram(path_counts, output=None):
     ksp_distinct_paths_counts = []
 
     for _, value in sorted(path_counts.items(), key=lambda kv: (kv[1]["8-ksp"], kv[0])):
@@ -207,13 +212,22 @@ def assemble_histogram(path_counts):
     plt.legend(loc="upper left")
     ax1.set_xlabel("Rank of Link")
     ax1.set_ylabel("# of Distinct Paths Link is on")
-    plt.show()
+    if output:
+        fig.savefig(output)
+    else:
+        plt.show()
 
 
 if __name__ == '__main__':
     args = reproduce_1c.parse_args()
-    jf_topo = jellyfish.Jellyfish(args.servers, args.switches, args.ports, 45)
-    all_nodes = jf_topo.switches + jf_topo.servers
+
+    report_base = reproduce_1c.profiling_base(args.output, 'reproduce_9')
+    profiling.configure(args.profile, report_base + '.profile')
+    profiling.start()
+
+    with profiling.span('generation'):
+        jf_topo = jellyfish.Jellyfish(args.servers, args.switches, args.ports, 45)
+        all_nodes = jf_topo.switches + jf_topo.servers
 
     derangement = random_derangement(685)
     derangment_links = []
@@ -227,10 +241,15 @@ if __name__ == '__main__':
         derangment_links.append((start_node, dest_node))
 
     parallelism = 40
-    topo = reproduce_1c.generate_tree_adj(all_nodes)
-    all_ksp = compute_all_k_shortest_paths(K, topo, parallelism, derangment_links)
+    with profiling.span('generation'):
+        topo = reproduce_1c.generate_tree_adj(all_nodes)
+    with profiling.span('ksp_all'):
+        all_ksp = compute_all_k_shortest_paths(K, topo, parallelism, derangment_links)
     all_links = topo_get_all_links(topo)
 
-    path_counts = get_path_counts(all_ksp, derangement, all_links, jf_topo.servers)
-    assemble_histogram(path_counts)
+    with profiling.span('path_counts'):
+        path_counts = get_path_counts(all_ksp, derangement, all_links, jf_topo.servers)
+    with profiling.span('plotting'):
+        assemble_histogram(path_counts, args.output)
+    profiling.write_reports(report_base)
 
@@ -15,12 +15,18 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
 import sys
 import random
 import queue
 import networkx as nx
+import numpy as np
 # importing matplotlib.pyplot
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from xml.sax.saxutils import escape, quoteattr
 
 from collections import defaultdict
 
@@ -146,7 +152,200 @@ def generate_random_regular_graph_edges(node_degree, number_of_nodes, seed=None)
     return edges
 
 
-def draw_topology(nodes):
+# Layer of each node type, top to bottom, used by the layered layout
+NODE_LAYERS = {
+    'Switch Level 1': 0,
+    'Switch Level 2': 1,
+    'Switch Level 3': 2,
+    'Server': 3,
+    'sw': 0,
+    'sv': 1,
+}
+
+# Above this many nodes the nodes are not labelled when rendering
+MAX_LABELLED_NODES = 200
+
+
+# Yield every node reachable in one hop from the given nodes, each only once
+def iter_topology_nodes(nodes):
+    seen = set()
+    for node in nodes:
+        if id(node) not in seen:
+            seen.add(id(node))
+            yield node
+        for edge in node.edges:
+            for neighbour in (edge.lnode, edge.rnode):
+                if id(neighbour) not in seen:
+                    seen.add(id(neighbour))
+                    yield neighbour
+
+
+# Yield every edge attached to the given nodes, each only once
+def iter_topology_edges(nodes):
+    seen = set()
+    for node in nodes:
+        for edge in node.edges:
+            if id(edge) not in seen:
+                seen.add(id(edge))
+                yield edge
+
+
+def _write_graphml(nodes, output):
+    output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    output.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+    output.write('  <key id="type" for="node" attr.name="type" attr.type="string"/>\n')
+    output.write('  <key id="bw" for="edge" attr.name="bw" attr.type="double"/>\n')
+    output.write('  <graph id="topology" edgedefault="undirected">\n')
+    for node in iter_topology_nodes(nodes):
+        output.write(f'    <node id={quoteattr(node.id)}><data key="type">{escape(node.type)}</data></node>\n')
+    for edge in iter_topology_edges(nodes):
+        output.write(f'    <edge source={quoteattr(edge.lnode.id)} target={quoteattr(edge.rnode.id)}>'
+                     f'<data key="bw">{edge.bw}</data></edge>\n')
+    output.write('  </graph>\n')
+    output.write('</graphml>\n')
+
+
+def _write_dot(nodes, output):
+    output.write('graph topology {\n')
+    for node in iter_topology_nodes(nodes):
+        output.write(f'  "{node.id}" [type="{node.type}"];\n')
+    for edge in iter_topology_edges(nodes):
+        output.write(f'  "{edge.lnode.id}" -- "{edge.rnode.id}" [bw={edge.bw}];\n')
+    output.write('}\n')
+
+
+def _write_edge_list(nodes, output):
+    for edge in iter_topology_edges(nodes):
+        output.write(f'{edge.lnode.id} {edge.rnode.id} {edge.bw}\n')
+
+
+TOPOLOGY_WRITERS = {
+    'graphml': _write_graphml,
+    'dot': _write_dot,
+    'gv': _write_dot,
+    'edges': _write_edge_list,
+    'edgelist': _write_edge_list,
+    'txt': _write_edge_list,
+}
+
+
+# Stream the topology to a GraphML, DOT or edge-list file, picked from the extension unless fmt is given
+def export_topology(nodes, path, fmt=None):
+    if fmt is None:
+        fmt = os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in TOPOLOGY_WRITERS:
+        raise NetworkError(f"Unknown topology export format: {fmt}")
+
+    with open(path, 'w') as output:
+        TOPOLOGY_WRITERS[fmt](nodes, output)
+
+
+# Index the nodes and turn the edges into two arrays of node indices
+def _topology_arrays(nodes):
+    all_nodes = list(iter_topology_nodes(nodes))
+    index = {id(node): i for i, node in enumerate(all_nodes)}
+    edges = [(index[id(edge.lnode)], index[id(edge.rnode)]) for edge in iter_topology_edges(nodes)]
+    edges = np.array(edges, dtype=np.int64).reshape(-1, 2)
+    return all_nodes, edges[:, 0], edges[:, 1]
+
+
+# Spread the nodes of every layer evenly on a horizontal line, layers top to bottom
+def layered_layout(all_nodes):
+    layers = np.array([NODE_LAYERS.get(node.type, 0) for node in all_nodes], dtype=np.int64)
+    counts = np.bincount(layers)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    order = np.argsort(layers, kind='stable')
+
+    rank = np.empty(len(all_nodes), dtype=np.int64)
+    rank[order] = np.arange(len(all_nodes)) - np.repeat(starts, counts)
+
+    x = (rank + 0.5) / counts[layers]
+    y = 1.0 - layers / max(layers.max(), 1)
+    return np.column_stack((x, y))
+
+
+def circular_layout(all_nodes):
+    angles = np.linspace(0, 2 * np.pi, len(all_nodes), endpoint=False)
+    return np.column_stack((np.cos(angles), np.sin(angles)))
+
+
+# Spectral layout from the two leading non-trivial eigenvectors of the random-walk matrix, found with
+# power iteration over the edge arrays so it stays linear in the number of edges
+def spectral_layout(all_nodes, u, v, iterations=200, seed=0):
+    num_nodes = len(all_nodes)
+    degree = np.bincount(np.concatenate((u, v)), minlength=num_nodes).astype(float)
+    degree[degree == 0] = 1.0
+
+    rng = np.random.default_rng(seed)
+    pos = rng.random((num_nodes, 2))
+    for _ in range(iterations):
+        neighbours_sum = np.zeros_like(pos)
+        np.add.at(neighbours_sum, u, pos[v])
+        np.add.at(neighbours_sum, v, pos[u])
+        pos = 0.5 * (pos + neighbours_sum / degree[:, None])
+
+        # Keep the vectors degree-orthogonal to the constant vector and to each other
+        pos -= (pos * degree[:, None]).sum(axis=0) / degree.sum()
+        pos[:, 1] -= pos[:, 0] * (pos[:, 0] * pos[:, 1] * degree).sum() / (pos[:, 0] ** 2 * degree).sum()
+        pos /= np.linalg.norm(pos, axis=0)
+
+    return pos
+
+
+def _is_fat_tree(all_nodes):
+    return all(node.type.startswith('Switch Level') or node.type == 'Server' for node in all_nodes)
+
+
+def compute_layout(nodes, layout='auto'):
+    all_nodes, u, v = _topology_arrays(nodes)
+    if layout == 'auto':
+        layout = 'layered' if _is_fat_tree(all_nodes) else 'spectral'
+
+    if layout == 'layered':
+        pos = layered_layout(all_nodes)
+    elif layout == 'circular':
+        pos = circular_layout(all_nodes)
+    elif layout == 'spectral':
+        pos = spectral_layout(all_nodes, u, v)
+    else:
+        raise NetworkError(f"Unknown topology layout: {layout}")
+
+    return all_nodes, pos, u, v
+
+
+# Render the topology without a display to a PNG or SVG file; edges are rasterized so large graphs stay small
+def render_topology(nodes, path, layout='auto', dpi=150):
+    all_nodes, pos, u, v = compute_layout(nodes, layout)
+
+    fig = Figure(figsize=(16, 10))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.set_axis_off()
+
+    segments = np.stack((pos[u], pos[v]), axis=1)
+    linewidth = 0.8 if len(all_nodes) <= MAX_LABELLED_NODES else 0.1
+    ax.add_collection(LineCollection(segments, linewidths=linewidth, colors='grey', alpha=0.6, rasterized=True))
+
+    layers = np.array([NODE_LAYERS.get(node.type, 0) for node in all_nodes])
+    node_size = 60 if len(all_nodes) <= MAX_LABELLED_NODES else 2
+    ax.scatter(pos[:, 0], pos[:, 1], s=node_size, c=layers, cmap='viridis', zorder=2, rasterized=True)
+
+    if len(all_nodes) <= MAX_LABELLED_NODES:
+        for node, (x, y) in zip(all_nodes, pos):
+            ax.annotate(node.id, (x, y), fontsize=6, ha='center', va='bottom')
+
+    ax.autoscale_view()
+    fig.savefig(path, dpi=dpi, bbox_inches='tight')
+
+
+def draw_topology(nodes, path=None, layout='auto'):
+    if path is not None:
+        if path.lower().endswith(('.png', '.svg', '.pdf')):
+            render_topology(nodes, path, layout)
+        else:
+            export_topology(nodes, path)
+        return
+
     g = nx.Graph()
     for node in nodes:
         for edge in node.edges:
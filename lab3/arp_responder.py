@@ -0,0 +1,81 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# ARP on behalf of the servers, so that no ARP broadcast is flooded through the loops of the
+# fat-tree. The IP to MAC table starts from the addresses fat-tree.py gives the servers and learns
+# from the ARP packets the switches send to the controller. Requests for a known address are
+# answered by the controller on the port they came in on. Other requests, and the replies to them,
+# are sent straight out of the port of the server they are addressed to, on its edge switch.
+
+# !/usr/bin/env python3
+import socket
+import struct
+
+import packet_parser
+import topo
+
+ARP_HEADER = struct.Struct('!HHBBH6s4s6s4s')
+
+
+def mac_to_bytes(mac):
+    return bytes.fromhex(mac.replace(':', ''))
+
+
+# ARP reply telling dst_mac/dst_ip that src_ip is at src_mac
+def arp_reply(src_mac, src_ip, dst_mac, dst_ip):
+    eth_header = mac_to_bytes(dst_mac) + mac_to_bytes(src_mac) + packet_parser.UINT16.pack(packet_parser.ETH_TYPE_ARP)
+    return eth_header + ARP_HEADER.pack(1, packet_parser.ETH_TYPE_IP, 6, 4, packet_parser.ARP_REPLY,
+                                        mac_to_bytes(src_mac), socket.inet_aton(src_ip),
+                                        mac_to_bytes(dst_mac), socket.inet_aton(dst_ip))
+
+
+class ArpResponder:
+    # datapaths is the dpid -> datapath dict of the app, servers the servers of topo.Fattree,
+    # switch_ports the port plan of topo.switch_ports and event_log the event_log.EventLog of the app
+    def __init__(self, datapaths, servers, switch_ports, event_log):
+        self.datapaths = datapaths
+        self.event_log = event_log
+        self.ip_to_mac = {server.ip_address: topo.server_mac(server.ip_address) for server in servers}
+        # server ip -> (dpid of its edge switch, port of the server)
+        self.server_ports = {}
+        for server in servers:
+            edge = server.edges[0].left_node
+            self.server_ports[server.ip_address] = (topo.node_dpid(edge.id), switch_ports[(edge.id, server.id)])
+
+    # Handle an ARP packet-in, pkt as returned by packet_parser.parse
+    def handle(self, datapath, in_port, pkt, data):
+        self.ip_to_mac[pkt.src_ip] = pkt.eth_src
+        if pkt.src_ip == pkt.dst_ip:
+            return
+
+        mac = self.ip_to_mac.get(pkt.dst_ip)
+        if pkt.arp_op == packet_parser.ARP_REQUEST and mac is not None:
+            self.packet_out(datapath, in_port, arp_reply(mac, pkt.dst_ip, pkt.eth_src, pkt.src_ip))
+            return
+
+        server_port = self.server_ports.get(pkt.dst_ip)
+        if server_port is None or server_port[0] not in self.datapaths:
+            self.event_log.warning('arp_no_server', 'dst_ip=%s dropping ARP packet', pkt.dst_ip)
+            return
+        self.packet_out(self.datapaths[server_port[0]], server_port[1], data)
+
+    def packet_out(self, datapath, port, data):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        out = parser.OFPPacketOut(datapath=datapath, buffer_id=ofproto.OFP_NO_BUFFER, in_port=ofproto.OFPP_CONTROLLER,
+                                  actions=[parser.OFPActionOutput(port)], data=data)
+        datapath.send_msg(out)
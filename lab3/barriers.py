@@ -0,0 +1,58 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+# Holds back packet-outs until the switches that got flow entries for them have answered a barrier
+# request, so that the packet never reaches a switch before its entry. The apps pass their
+# EventOFPBarrierReply messages to barrier_reply. Given a flow_mods.FlowModBatcher, the barriers and
+# the packet-outs without any are queued behind the flow-mods of the handler.
+class BarrierGate:
+    def __init__(self, flow_mods=None):
+        self.flow_mods = flow_mods
+        # (dpid, xid) -> [packet-out, number of barrier replies still missing]
+        self.waiting = {}
+
+    def send(self, datapath, msg):
+        if self.flow_mods is None:
+            datapath.send_msg(msg)
+        else:
+            self.flow_mods.send(datapath, msg)
+
+    def send_after_barriers(self, datapaths, packet_out):
+        if not datapaths:
+            self.send(packet_out.datapath, packet_out)
+            return
+
+        pending = [packet_out, len(datapaths)]
+        for datapath in datapaths:
+            barrier = datapath.ofproto_parser.OFPBarrierRequest(datapath)
+            datapath.set_xid(barrier)
+            self.waiting[(datapath.id, barrier.xid)] = pending
+            self.send(datapath, barrier)
+
+    def barrier_reply(self, msg):
+        pending = self.waiting.pop((msg.datapath.id, msg.xid), None)
+        if pending is None:
+            return
+        pending[1] -= 1
+        if pending[1] == 0:
+            pending[0].datapath.send_msg(pending[0])
+
+    # Drop the packet-outs waiting for a switch that disconnected
+    def forget(self, dpid):
+        for key in [key for key in self.waiting if key[0] == dpid]:
+            del self.waiting[key]
@@ -0,0 +1,284 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import argparse
+import contextlib
+import ipaddress
+import os
+import re
+import socket
+import struct
+import time
+
+import packet_parser
+import topo
+import two_level_routing
+
+DEFAULT_SCALES = [4, 8, 16, 24, 32, 64]
+
+
+def quiet(fn, *args):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return fn(*args)
+
+
+def fat_tree_nodes(ft_topo):
+    return ft_topo.servers + ft_topo.core_switches + ft_topo.agg_switches + ft_topo.edge_switches
+
+
+# The all-servers Dijkstra SPRouter used before the BFS precompute, kept as the reference
+def legacy_shortest_paths(ft_topo):
+    all_nodes = fat_tree_nodes(ft_topo)
+
+    def minimum_distance(distance, visited_set):
+        min = float('Inf')
+        selected = list(visited_set)[0]
+        for node in visited_set:
+            if distance[node.ip_address] < min:
+                min = distance[node.ip_address]
+                selected = node
+        return selected
+
+    def get_shortest_paths(server):
+        distance = {node.ip_address: float('inf') for node in all_nodes}
+        previous = {node.ip_address: None for node in all_nodes}
+        distance[server.ip_address] = 0
+
+        visited_set = set(all_nodes)
+        while len(visited_set) > 0:
+            node_with_smallest_distance = minimum_distance(distance, visited_set)
+            visited_set.remove(node_with_smallest_distance)
+            for node in all_nodes:
+                if node_with_smallest_distance.is_neighbor(node):
+                    if distance[node_with_smallest_distance.ip_address] + 1 < distance[node.ip_address]:
+                        distance[node.ip_address] = distance[node_with_smallest_distance.ip_address] + 1
+                        previous[node.ip_address] = node_with_smallest_distance.ip_address
+        return previous
+
+    return {server.ip_address: get_shortest_paths(server) for server in ft_topo.servers}
+
+
+# Every benchmark has a setup that is not measured and returns the callable that is, or the
+# callable and the number of events it handles to also report a rate. max_k bounds the scales it
+# is run at.
+def bench_sp_precompute(k):
+    ft_topo = quiet(topo.Fattree, k)
+    return lambda: topo.server_next_hops(fat_tree_nodes(ft_topo), ft_topo.servers)
+
+
+def bench_sp_precompute_legacy(k):
+    ft_topo = quiet(topo.Fattree, k)
+    return lambda: legacy_shortest_paths(ft_topo)
+
+
+# The string-based table generation FTRouter used before fat_tree_routing_table, kept as the
+# reference. Its suffix next hops only exist for k=4.
+def legacy_routing_tables(ft_topo):
+    num_ports = ft_topo.num_ports
+    ip_to_id = {node.ip_address: node.id for node in fat_tree_nodes(ft_topo)}
+    routing_table_prefixes = {}
+    routing_table_suffixes = {}
+
+    def network_mask(network_str):
+        n = ipaddress.ip_network(network_str, strict=False)
+        return network_str, int(n.network_address), int(n.netmask)
+
+    for pod in range(0, ft_topo.num_pods):
+        for switch in range(int(num_ports / 2), num_ports):
+            for subnet in range(0, int(num_ports / 2)):
+                switch_ip_address = f'10.{pod}.{switch}.1'
+                routing_table_prefixes.setdefault(switch_ip_address, []).append(
+                    (f'10.{pod}.{subnet}.0/24', f'10.{pod}.{subnet}.1', 2))
+            for id in range(2, int(num_ports / 2) + 2):
+                switch_ip_address = f'10.{pod}.{switch}.1'
+                port = int(((id - 2 + switch) % (num_ports / 2)) + (num_ports / 2))
+                next_hop = f'10.{ft_topo.num_pods}.{switch - (int(num_ports / 2) - 1)}.{port - 1}'
+                routing_table_suffixes.setdefault(switch_ip_address, []).append((f'0.0.0.{id}', next_hop, 1))
+
+    for j in range(1, int(num_ports / 2) + 1):
+        for i in range(1, int(num_ports / 2) + 1):
+            for x in range(0, num_ports):
+                routing_table_prefixes.setdefault(f'10.{num_ports}.{j}.{i}', []).append(
+                    (f'10.{x}.0.0/16', f'10.{x}.{j + (int(num_ports / 2) - 1)}.1', 1))
+
+    for pod in range(0, ft_topo.num_pods):
+        for i in range(0, int(num_ports / 2)):
+            switch_ip_address = f'10.{pod}.{i}.1'
+            for host_id in range(2, int(num_ports / 2) + 2):
+                routing_table_prefixes.setdefault(switch_ip_address, []).append(
+                    (f'10.{pod}.{i}.{host_id}/32', f'10.{pod}.{i}.{host_id}', 1))
+            routing_table_prefixes.setdefault(switch_ip_address, []).append(
+                ('0.0.0.0/0', f'10.{pod}.{i + int(num_ports / 2)}.1', 1))
+
+    routing_table_prefixes = {
+        ip_to_id[key]: [(network_mask(value2[0]), ip_to_id[value2[1]], value2[1], value2[2]) for value2 in value]
+        for key, value in routing_table_prefixes.items()}
+    routing_table_suffixes = {
+        ip_to_id[key]: [(value2[0], ip_to_id[value2[1]], value2[1], value2[2]) for value2 in value]
+        for key, value in routing_table_suffixes.items()}
+    return routing_table_prefixes, routing_table_suffixes
+
+
+# The sequential prefix/suffix lookup FTRouter used before TwoLevelTable, kept as the reference
+def legacy_next_hop(routing_tables, current_sw, destination_ip):
+    routing_table_prefixes, routing_table_suffixes = routing_tables
+
+    def is_address_in_network(ip, netw, mask):
+        a = int(ipaddress.ip_address(ip))
+        return (a & mask) == netw
+
+    def extract_ip(ip_str):
+        l = re.split(r'(.*)\.(.*)\.(.*)\.(.*)', ip_str)
+        return l[1:-1]
+
+    for (network_str, netw, mask), hop, hop_ip_address, priority in routing_table_prefixes[current_sw]:
+        if is_address_in_network(destination_ip, netw, mask):
+            return hop, hop_ip_address, priority
+
+    for ip_addr, hop, hop_ip_address, priority in routing_table_suffixes[current_sw]:
+        if extract_ip(destination_ip)[3] == extract_ip(ip_addr)[3]:
+            return hop, hop_ip_address, priority
+
+    raise Exception(f"No route could be identified for ip: {destination_ip}, switch: {current_sw}")
+
+
+def fat_tree_node_ids(ft_topo):
+    return {two_level_routing.ip_to_int(node.ip_address): node.id for node in fat_tree_nodes(ft_topo)}
+
+
+def switch_server_queries(ft_topo):
+    switches = ft_topo.core_switches + ft_topo.agg_switches + ft_topo.edge_switches
+    return [(switch.id, server.ip_address) for switch in switches for server in ft_topo.servers]
+
+
+def bench_ft_tables(k):
+    ft_topo = quiet(topo.Fattree, k)
+    node_ids = fat_tree_node_ids(ft_topo)
+    return lambda: two_level_routing.fat_tree_routing_table(k, node_ids)
+
+
+def bench_ft_tables_legacy(k):
+    ft_topo = quiet(topo.Fattree, k)
+    return lambda: legacy_routing_tables(ft_topo)
+
+
+# One lookup for every (switch, server) pair, the destination parsed once per lookup as on packet-in
+def bench_ft_lookup(k):
+    ft_topo = quiet(topo.Fattree, k)
+    table = two_level_routing.fat_tree_routing_table(k, fat_tree_node_ids(ft_topo))
+    queries = switch_server_queries(ft_topo)
+    return lambda: [table.lookup(switch, two_level_routing.ip_to_int(ip)) for switch, ip in queries]
+
+
+def bench_ft_lookup_legacy(k):
+    ft_topo = quiet(topo.Fattree, k)
+    routing_tables = legacy_routing_tables(ft_topo)
+    queries = switch_server_queries(ft_topo)
+    return lambda: [legacy_next_hop(routing_tables, switch, ip) for switch, ip in queries]
+
+
+# The frames of a ping between every pair of servers as the switches send them to the controller:
+# the ARP request and the ICMP echo request
+def server_pair_frames(ft_topo):
+    frames = []
+    for i, src in enumerate(ft_topo.servers):
+        for j, dst in enumerate(ft_topo.servers):
+            if src is dst:
+                continue
+            src_mac = struct.pack('!HI', 0, i + 1)
+            dst_mac = struct.pack('!HI', 0, j + 1)
+            src_ip = socket.inet_aton(src.ip_address)
+            dst_ip = socket.inet_aton(dst.ip_address)
+            frames.append(b'\xff' * 6 + src_mac + struct.pack('!HHHBBH6s4s6s4s', packet_parser.ETH_TYPE_ARP, 1,
+                                                              packet_parser.ETH_TYPE_IP, 6, 4, 1, src_mac, src_ip,
+                                                              b'\x00' * 6, dst_ip))
+            frames.append(dst_mac + src_mac + struct.pack('!HBBHHHBBH4s4sBBHHH', packet_parser.ETH_TYPE_IP, 0x45, 0,
+                                                          28, 0, 0, 64, 1, 0, src_ip, dst_ip, 8, 0, 0, 0, 0))
+    return frames
+
+
+# Parse every frame for the fields the packet-in handlers read
+def bench_packet_in_parse(k):
+    frames = server_pair_frames(quiet(topo.Fattree, k))
+    return lambda: [packet_parser.parse(frame) for frame in frames], len(frames)
+
+
+# The same fields through ryu.lib.packet, as the handlers read them before packet_parser
+def bench_packet_in_parse_legacy(k):
+    from ryu.lib.packet import packet, ethernet, arp, ipv4, ether_types
+
+    def parse(frame):
+        pkt = packet.Packet(frame)
+        eth = pkt.get_protocol(ethernet.ethernet)
+        if eth.ethertype == ether_types.ETH_TYPE_ARP:
+            arp_pkt = pkt.get_protocol(arp.arp)
+            return eth.dst, eth.src, eth.ethertype, arp_pkt.src_ip, arp_pkt.dst_ip, arp_pkt.opcode
+        ip_pkt = pkt.get_protocol(ipv4.ipv4)
+        return eth.dst, eth.src, eth.ethertype, ip_pkt.src, ip_pkt.dst, None
+
+    frames = server_pair_frames(quiet(topo.Fattree, k))
+    return lambda: [parse(frame) for frame in frames], len(frames)
+
+
+BENCHMARKS = [
+    ('sp_precompute', bench_sp_precompute, 32),
+    ('sp_precompute[legacy]', bench_sp_precompute_legacy, 8),
+    ('ft_tables', bench_ft_tables, 64),
+    ('ft_tables[legacy]', bench_ft_tables_legacy, 4),
+    ('ft_lookup', bench_ft_lookup, 16),
+    ('ft_lookup[legacy]', bench_ft_lookup_legacy, 4),
+    ('packet_in_parse', bench_packet_in_parse, 8),
+    ('packet_in_parse[legacy]', bench_packet_in_parse_legacy, 8),
+]
+
+
+def run_benchmarks(options):
+    for name, setup, max_k in BENCHMARKS:
+        if options.only and not any(selected in name for selected in options.only):
+            continue
+        for k in options.scales:
+            if k > max_k:
+                continue
+            run = setup(k)
+            events = None
+            if isinstance(run, tuple):
+                run, events = run
+            times = []
+            for _ in range(options.repeat):
+                start_time = time.perf_counter()
+                run()
+                times.append(time.perf_counter() - start_time)
+            rate = f' {events / min(times):>12.0f} events/s' if events else ''
+            print(f'{name + "@k=" + str(k):<40} {min(times):>10.4f} s{rate}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the route computations and packet-in parsing of the lab3 controllers')
+
+    parser.add_argument('-k', '--scales', dest='scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help='Fat-tree port counts to run at')
+
+    parser.add_argument('--only', dest='only', nargs='+', default=None,
+                        help='Only run benchmarks whose name contains one of these strings')
+
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                        help='Timed runs per benchmark, the best one is reported')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    run_benchmarks(parse_args())
@@ -0,0 +1,143 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Event log of the controllers, in place of a print on every packet-in. Every event has a kind,
+# such as packet_in_ip or flow_added, and a level. EventLog counts every event per kind, also the
+# ones below log_level, so that the per-packet events can stay off and still show in the counters.
+# At most log_rate_limit events per kind and second are logged, the next logged event of the kind
+# tells how many were left out.
+#
+# The events go to a queue that a native thread writes out, to log_file or stderr, so the
+# handlers neither format nor write them. When log_buffer_size events are waiting further ones
+# are dropped and counted.
+
+# !/usr/bin/env python3
+import collections
+import logging
+import sys
+import time
+
+from eventlet import patcher
+
+from routing_config import CONF
+
+# ryu-manager patches threading and queue into green threads, the writer needs the real ones
+threading = patcher.original('threading')
+queue = patcher.original('queue')
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(event)s] %(message)s'
+
+# Events written in one go once the writer wakes up
+WRITE_BATCH = 256
+
+_writer = None
+
+
+class BufferedWriter(logging.Handler):
+    def __init__(self, stream, capacity):
+        super(BufferedWriter, self).__init__()
+        self.stream = stream
+        self.records = queue.Queue(capacity)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._write, name='event_log', daemon=True)
+        self.thread.start()
+
+    def emit(self, record):
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        while True:
+            records = [self.records.get()]
+            while len(records) < WRITE_BATCH:
+                try:
+                    records.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.stream.write(''.join(self.format(record) + '\n' for record in records))
+                self.stream.flush()
+            except Exception:
+                for record in records:
+                    self.handleError(record)
+
+
+# Writer of the 'routing' loggers, set up on first use from the options
+def writer():
+    global _writer
+    if _writer is None:
+        stream = open(CONF.routing.log_file, 'a') if CONF.routing.log_file else sys.stderr
+        _writer = BufferedWriter(stream, CONF.routing.log_buffer_size)
+        _writer.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger = logging.getLogger('routing')
+        logger.setLevel(CONF.routing.log_level.upper())
+        logger.addHandler(_writer)
+        logger.propagate = False
+    return _writer
+
+
+class EventLog:
+    def __init__(self, name):
+        self.writer = writer()
+        self.logger = logging.getLogger('routing.' + name)
+        # Options are slow to read, the handlers log on every packet-in
+        self.rate_limit = CONF.routing.log_rate_limit
+        self.counters = collections.Counter()
+        # kind -> [start of the current second, events logged in it]
+        self.windows = {}
+        self.suppressed = collections.Counter()
+
+    def debug(self, kind, message, *args):
+        self.event(logging.DEBUG, kind, message, *args)
+
+    def info(self, kind, message, *args):
+        self.event(logging.INFO, kind, message, *args)
+
+    def warning(self, kind, message, *args):
+        self.event(logging.WARNING, kind, message, *args)
+
+    # Count an event and log it, message % args, unless its level is off or its kind is over the rate
+    def event(self, level, kind, message, *args):
+        self.counters[kind] += 1
+        if not self.logger.isEnabledFor(level):
+            return
+
+        if self.rate_limit > 0:
+            now = time.monotonic()
+            window = self.windows.get(kind)
+            if window is None or now - window[0] >= 1.0:
+                window = self.windows[kind] = [now, 0]
+            if window[1] >= self.rate_limit:
+                self.suppressed[kind] += 1
+                return
+            window[1] += 1
+
+        suppressed = self.suppressed.pop(kind, 0)
+        if suppressed:
+            message += ' (%d more not logged)'
+            args += (suppressed,)
+        # Made here rather than by logger.log, which looks up the calling line in the stack first
+        self.logger.handle(self.logger.makeRecord(self.logger.name, level, '', 0, message, args, None,
+                                                  extra={'event': kind}))
+
+    # Counters of the events per kind, and of the events the writer dropped
+    def summary(self):
+        summary = {f'events_{kind}': count for kind, count in sorted(self.counters.items())}
+        summary['events_dropped'] = self.writer.dropped
+        return summary
@@ -19,6 +19,7 @@
 
 import os
 import subprocess
+import sys
 import time
 
 import mininet
@@ -41,7 +42,8 @@ class FattreeNet(Topo):
 
 	def __init__(self, ft_topo):
 		Topo.__init__(self)
-		self.servers = {node.id: self.addHost(node.id, ip=node.ip_address) for node in ft_topo.servers}
+		self.servers = {node.id: self.addHost(node.id, ip=node.ip_address, mac=topo.server_mac(node.ip_address))
+						for node in ft_topo.servers}
 		self.core_switches = {switch.id: self.addSwitch(switch.id) for switch in ft_topo.core_switches}
 		self.aggregation_switches = {switch.id: self.addSwitch(switch.id) for switch in ft_topo.agg_switches}
 		self.edge_switches = {switch.id: self.addSwitch(switch.id) for switch in ft_topo.edge_switches}
@@ -55,8 +57,12 @@ class FattreeNet(Topo):
 		link_opts = dict(cls=TCLink, bw=15, delay='5ms')
 
 		self.all_nodes = ft_topo.servers + ft_topo.core_switches + ft_topo.agg_switches + ft_topo.edge_switches
-		self.ft_links = {(edge.left_node.id, edge.right_node.id) for node in self.all_nodes for edge in node.edges}
-		self.ft_links = [self.addLink(self.ft_nodes[a], self.ft_nodes[b], **link_opts) for (a, b) in self.ft_links]
+		# Switch ports follow topo.switch_ports so that the controllers can use them before link discovery
+		ports = topo.switch_ports(self.all_nodes)
+		self.ft_links = [self.addLink(self.ft_nodes[edge.left_node.id], self.ft_nodes[edge.right_node.id],
+									  port1=ports.get((edge.left_node.id, edge.right_node.id)),
+									  port2=ports.get((edge.right_node.id, edge.left_node.id)), **link_opts)
+						 for edge in topo.unique_edges(self.all_nodes)]
 
 
 def make_mininet_instance(graph_topo):
@@ -66,7 +72,7 @@ def make_mininet_instance(graph_topo):
 	return net
 
 
-def run(graph_topo):
+def run(graph_topo, script='performence.sh'):
 	
 	# Run the Mininet CLI with a given topology
 	lg.setLogLevel('info')
@@ -76,12 +82,12 @@ def run(graph_topo):
 	info('*** Starting network ***\n')
 	net.start()
 	info('*** Running CLI ***\n')
-	script = 'performence.sh'
 	CLI(net, script=script)
 	CLI(net)
 	info('*** Stopping network ***\n')
 	net.stop()
 
 
-ft_topo = topo.Fattree(4)
-run(ft_topo)
\ No newline at end of file
+# Usage: fat-tree.py [k] [Mininet CLI script], e.g. hedera.sh for the flows of the Hedera scheduler
+ft_topo = topo.Fattree(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
+run(ft_topo, *sys.argv[2:3])
\ No newline at end of file
@@ -0,0 +1,148 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Batches the messages a handler sends to the switches. Until the first flow-mod of a new flow is
+# in the table, every further packet of the flow comes to the controller and asks for the same
+# flow-mod again. The batcher drops an add flow-mod that is identical, apart from its xid, to the
+# last one sent for the same entry (table, priority and match) of the switch, if that was less than
+# flow_mod_dedup_window seconds before. Any other flow-mod or a group delete can remove entries,
+# they forget what was sent to that switch.
+#
+# With flow_mod_batching the messages are queued per switch and flush writes the queue of every
+# switch as a single buffer, the apps flush at the end of their handlers. Barriers go through the
+# same queue, so a burst of flow-mods is followed by the barrier that confirms it.
+#
+# For warm_restart the batcher can also keep a shadow of the flow table of every switch: the add
+# flow-mods it sent, less the entries the delete flow-mods after them removed and those the switch
+# reports as removed. Entries with a timeout are sent with OFPFF_SEND_FLOW_REM for that.
+
+# !/usr/bin/env python3
+import collections
+import struct
+import time
+
+from routing_config import CONF
+
+# The match of a flow-mod starts after the fixed part, its length sits in the second half-word
+FLOW_MOD_MATCH_OFFSET = 48
+UINT16 = struct.Struct('!H')
+
+
+class FlowModBatcher:
+    def __init__(self):
+        # dpid -> (table, priority, match) -> (serialized add flow-mod without its header, time it was sent)
+        self.recent = {}
+        # dpid -> (datapath, [messages]) waiting for flush
+        self.queued = {}
+        self.counters = collections.Counter()
+        # dpid -> entry_key -> add flow-mod of the entry, None unless warm_restart tracks the tables
+        self.installed = None
+
+    # Send msg to the switch, or queue it with flow_mod_batching, unless it repeats an add flow-mod
+    # sent within the window. Returns whether it is sent.
+    def send(self, datapath, msg):
+        if msg.xid is None:
+            datapath.set_xid(msg)
+        if self.installed is not None and isinstance(msg, datapath.ofproto_parser.OFPFlowMod) and \
+                (msg.idle_timeout or msg.hard_timeout):
+            msg.flags |= datapath.ofproto.OFPFF_SEND_FLOW_REM
+        msg.serialize()
+        if not self.is_new(datapath, msg):
+            self.counters['duplicates'] += 1
+            return False
+
+        self.counters['messages'] += 1
+        if self.installed is not None:
+            self.track(datapath, msg)
+        if not CONF.routing.flow_mod_batching:
+            self.counters['writes'] += 1
+            datapath.send_msg(msg)
+            return True
+        self.queued.setdefault(datapath.id, (datapath, []))[1].append(msg)
+        return True
+
+    def is_new(self, datapath, msg):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        window = CONF.routing.flow_mod_dedup_window
+        if isinstance(msg, parser.OFPGroupMod) and msg.command == ofproto.OFPGC_DELETE:
+            self.recent.pop(datapath.id, None)
+        if not isinstance(msg, parser.OFPFlowMod):
+            return True
+        self.counters['flow_mods'] += 1
+        if msg.command != ofproto.OFPFC_ADD:
+            self.recent.pop(datapath.id, None)
+            return True
+        if window <= 0:
+            return True
+
+        now = time.monotonic()
+        recent = self.recent.setdefault(datapath.id, collections.OrderedDict())
+        while recent and next(iter(recent.values()))[1] <= now - window:
+            recent.popitem(last=False)
+        match_length = UINT16.unpack_from(msg.buf, FLOW_MOD_MATCH_OFFSET + 2)[0]
+        entry = (msg.table_id, msg.priority,
+                 bytes(msg.buf[FLOW_MOD_MATCH_OFFSET:FLOW_MOD_MATCH_OFFSET + (match_length + 7) // 8 * 8]))
+        # The header holds the xid, the rest is the same for the same flow-mod
+        content = bytes(msg.buf[8:])
+        if recent.get(entry, (None,))[0] == content:
+            return False
+        recent.pop(entry, None)
+        recent[entry] = (content, now)
+        return True
+
+    # Update the shadow flow table of the switch. A delete removes the entries of its table whose match
+    # has all of its fields, as the switch does; deletes and adds are all the apps send.
+    def track(self, datapath, msg):
+        ofproto = datapath.ofproto
+        if not isinstance(msg, datapath.ofproto_parser.OFPFlowMod):
+            return
+        entries = self.installed.setdefault(datapath.id, {})
+        key = entry_key(msg.table_id, msg.priority, msg.match)
+        if msg.command == ofproto.OFPFC_ADD:
+            entries[key] = msg
+        elif msg.command == ofproto.OFPFC_DELETE_STRICT:
+            entries.pop(key, None)
+        elif msg.command == ofproto.OFPFC_DELETE:
+            fields = set(key[2])
+            for deleted in [entry for entry in entries
+                            if msg.table_id in (ofproto.OFPTT_ALL, entry[0]) and fields <= set(entry[2])]:
+                del entries[deleted]
+
+    # Drop an entry the switch removed, after a timeout, from the shadow table
+    def removed(self, msg):
+        if self.installed is not None:
+            self.installed.get(msg.datapath.id, {}).pop(entry_key(msg.table_id, msg.priority, msg.match), None)
+
+    # Write the queued messages of every switch, one buffer per switch
+    def flush(self):
+        queued, self.queued = self.queued, {}
+        for datapath, messages in queued.values():
+            self.counters['writes'] += 1
+            datapath.send(b''.join(msg.buf for msg in messages))
+
+    # Drop what was sent and queued for a switch that disconnected, its shadow table stays for when it
+    # connects again
+    def forget(self, dpid):
+        self.recent.pop(dpid, None)
+        self.queued.pop(dpid, None)
+
+
+# Key of a flow entry in the shadow tables, the same for the match of a flow-mod and of a flow stats
+# reply whatever the order of the fields
+def entry_key(table_id, priority, match):
+    return table_id, priority, tuple(sorted(match.items()))
@@ -17,10 +17,8 @@
 
 # !/usr/bin/env python3
 import collections
-import pprint
 import ctypes
-import ipaddress
-import re
+import time
 
 from ryu.base import app_manager
 from ryu.controller import mac_to_port
@@ -29,44 +27,65 @@ from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.mac import haddr_to_bin
-from ryu.lib.packet import packet
-from ryu.lib.packet import ipv4
-from ryu.lib.packet import arp
-from ryu.lib.packet import ethernet
 from ryu.lib.packet import ether_types
 
 from ryu.topology import event, switches
-from ryu.topology.api import get_switch, get_link
 from ryu.app.wsgi import ControllerBase
 
 import topo
 import socket,struct
+from routing_config import CONF
+from topology_index import PortIndex
+from port_stats import PortStatsMonitor
+from barriers import BarrierGate
+from flow_mods import FlowModBatcher
+import packet_parser
+from arp_responder import ArpResponder
+from workers import LoopMetrics
+from event_log import EventLog
+from warm_restart import WarmRestart
+from two_level_routing import fat_tree_routing_table, ip_to_int, int_to_ip, prefix_length
+
+# Priorities of the proactive two-level pipeline: prefix entries sit above the IPv4 miss entry of
+# table 0 that continues to the suffix table
+PREFIX_BASE_PRIORITY = 2
+SUFFIX_TABLE = 1
+
+# Select group spreading flows over the uplinks of a switch when flow_hash_uplinks is set
+UPLINK_GROUP = 1
+
+# Fast-failover groups of the uplinks when fast_failover is set, numbered after the uplink index
+FAILOVER_GROUP_BASE = 1 << 16
 
 
 class FTRouter(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _CONTEXTS = {'port_stats': PortStatsMonitor}
 
     def __init__(self, *args, **kwargs):
-        self.switches = []
+        self.switches = set()
         self.links = []
+        self.link_ports = PortIndex()
+        self.port_stats = kwargs['port_stats']
         super(FTRouter, self).__init__(*args, **kwargs)
-        self.topo_net = topo.Fattree(4)
+        self.event_log = EventLog('FTRouter')
+        self.topo_net = topo.Fattree(CONF.routing.fat_tree_k)
         self.ip_to_id, self.id_to_ip = self.create_mappings()
-        self.core_switches_routing_table = {}
-        self.routing_table_prefixes = {}
-        self.routing_table_suffixes = {}
         self.create_2_way_routing_table()
-        self.mac_to_port = {}
-
-    def network_mask(self, network_str):
-        n = ipaddress.ip_network(network_str, strict=False)
-        netw = int(n.network_address)
-        mask = int(n.netmask)
-        return network_str, netw, mask
-
-    def is_address_in_network(self, ip, netw, mask):
-        a = int(ipaddress.ip_address(ip))
-        return (a & mask) == netw
+        self.switch_ports = topo.switch_ports(self.topo_net.core_switches + self.topo_net.agg_switches +
+                                              self.topo_net.edge_switches)
+        self.uplinks = {switch.id: [neighbour.id for neighbour in topo.uplink_neighbours(switch)]
+                        for switch in self.topo_net.agg_switches + self.topo_net.edge_switches}
+        self.datapaths = {}
+        self.arp = ArpResponder(self.datapaths, self.topo_net.servers, self.switch_ports, self.event_log)
+        self.flow_mods = FlowModBatcher()
+        self.loop_metrics = LoopMetrics(self, flow_mods=self.flow_mods, event_log=self.event_log)
+        self.barriers = BarrierGate(self.flow_mods)
+        # dpid -> masks of the prefix buckets installed as guards of aggregated entries
+        self.prefix_guards = {}
+        self.warm_restart = WarmRestart('FTRouter', self.flow_mods, self.event_log, self.learned_state)
+        if self.warm_restart.state is not None:
+            self.restore_state(self.warm_restart.state)
 
     def create_mappings(self):
         all_nodes = self.topo_net.servers + self.topo_net.edge_switches + self.topo_net.agg_switches + \
@@ -76,170 +95,343 @@ class FTRouter(app_manager.RyuApp):
 
         return ip_to_id, id_to_ip
 
-    def extract_ip(self, ip_str):
-        l = re.split(r'(.*)\.(.*)\.(.*)\.(.*)', ip_str)
-        return l[1:-1]
-
     def create_2_way_routing_table(self):
-        for pod in range(0, self.topo_net.num_pods):
-            for switch in range(int(self.topo_net.num_ports / 2), self.topo_net.num_ports):
-                for subnet in range(0, int(self.topo_net.num_ports / 2)):
-                    switch_ip_address = f'10.{pod}.{switch}.1'
-                    switch_prefix = f'10.{pod}.{subnet}.0/24'
-                    next_hop = f'10.{pod}.{subnet}.1'
-                    self.routing_table_prefixes.setdefault(switch_ip_address, []).append((switch_prefix, next_hop, 2))
-                for id in range(2, int(self.topo_net.num_ports / 2) + 2):
-                    switch_ip_address = f'10.{pod}.{switch}.1'
-                    switch_suffix = f'0.0.0.{id}'
-                    port = int(((id - 2 + switch) % (self.topo_net.num_ports / 2)) + (self.topo_net.num_ports / 2))
-                    next_hop = f'10.{self.topo_net.num_pods}.{switch - (int(self.topo_net.num_ports / 2) - 1)}.{port - 1}'
-                    self.routing_table_suffixes.setdefault(switch_ip_address, []).append((switch_suffix, next_hop, 1))
-
-        for j in range(1, int(self.topo_net.num_ports / 2) + 1):
-            for i in range(1, int(self.topo_net.num_ports / 2) + 1):
-                for x in range(0, self.topo_net.num_ports):
-                    switch_ip_address = f'10.{self.topo_net.num_ports}.{j}.{i}'
-                    switch_prefix = f'10.{x}.0.0/16'
-                    next_hop = f'10.{x}.{j + (int(self.topo_net.num_ports / 2) - 1)}.1'
-                    self.routing_table_prefixes.setdefault(switch_ip_address, []).append((switch_prefix, next_hop, 1))
-
-        for pod in range(0, self.topo_net.num_pods):
-            for i in range(0, int(self.topo_net.num_ports / 2)):
-                switch_ip_address = f'10.{pod}.{i}.1'
-                for host_id in range(2, int(self.topo_net.num_ports/2) + 2):
-                    switch_prefix = f'10.{pod}.{i}.{host_id}/32'
-                    self.routing_table_prefixes.setdefault(switch_ip_address, []).append((switch_prefix,
-                                                                                 f'10.{pod}.{i}.{host_id}', 1))
-
-                switch_prefix = f'0.0.0.0/0'
-                next_hop = f'10.{pod}.{i + int(self.topo_net.num_ports / 2)}.1'
-                self.routing_table_prefixes.setdefault(switch_ip_address, []).append((switch_prefix, next_hop, 1))
-
-        self.routing_table_prefixes = {
-            self.ip_to_id[key]: [(self.network_mask(value2[0]), self.ip_to_id[value2[1]], value2[1], value2[2]) for value2 in value]
-           for key, value in self.routing_table_prefixes.items()}
-
-        self.routing_table_suffixes = {
-            self.ip_to_id[key]: [(value2[0], self.ip_to_id[value2[1]], value2[1], value2[2]) for value2 in value]
-            for key, value in self.routing_table_suffixes.items()}
-
-        print("Routing table prefixes: ")
-        pprint.pprint(self.routing_table_prefixes)
-        print("Routing table suffixes: ")
-        pprint.pprint(self.routing_table_suffixes)
+        node_ids = {ip_to_int(ip_address): node_id for ip_address, node_id in self.ip_to_id.items()}
+        self.routing_table = fat_tree_routing_table(self.topo_net.num_ports, node_ids)
 
-    def get_next_hop_for_current_switch(self, current_sw, destination_ip):
-        routing_information_list = self.routing_table_prefixes[current_sw]
+        if CONF.routing.print_routing_tables:
+            self.event_log.info('routing_table', 'two-level routing table:\n%s', '\n'.join(self.routing_table.dump()))
 
-        for routing_information in routing_information_list:
-            network_str, netw, mask = routing_information[0]
-            hop = routing_information[1]
-            hop_ip_address = routing_information[2]
-            priority = routing_information[3]
-            if self.is_address_in_network(destination_ip, netw, mask):
-                return hop, hop_ip_address, priority
+    def get_next_hop_for_current_switch(self, current_sw, destination_ip):
+        return self.routing_table.lookup(current_sw, ip_to_int(destination_ip))
 
-        routing_information_list = self.routing_table_suffixes[current_sw]
+    # State that warm_restart keeps over a restart: the guard prefixes of the aggregated entries and
+    # the ARP table
+    def learned_state(self):
+        return {'prefix_guards': {str(dpid): sorted(masks) for dpid, masks in self.prefix_guards.items()},
+                'ip_to_mac': dict(self.arp.ip_to_mac)}
 
-        for routing_information in routing_information_list:
-            ip_addr, hop, hop_ip_address, priority = routing_information
-            if self.extract_ip(destination_ip)[3] == self.extract_ip(ip_addr)[3]:
-                return hop, hop_ip_address, priority
+    def restore_state(self, state):
+        self.prefix_guards = {int(dpid): set(masks) for dpid, masks in state['prefix_guards'].items()}
+        self.arp.ip_to_mac.update(state['ip_to_mac'])
 
-        raise Exception(f"No route could be identified for ip: {destination_ip}, switch: {current_sw}")
+    def stop(self):
+        self.warm_restart.save()
+        super(FTRouter, self).stop()
 
-    # Topology discovery
+    # Topology discovery, kept up to date from the events instead of fetching all switches and
+    # links again whenever a switch enters
     @set_ev_cls(event.EventSwitchEnter)
     def get_topology_data(self, ev):
-        # Switches and links in the network
-        switches = get_switch(self, None)
-        self.switches = [switch.dp.id for switch in switches]
-
-        self.switches_links = get_link(self, None)
-        print(f"{len(self.switches)} Switches={self.switches}")
-        print(f"{len(self.switches_links)} links")
+        self.switches.add(ev.switch.dp.id)
+        topo.check_discovered_switches(self.topo_net, len(self.switches))
+        self.event_log.info('switch_enter', 'switch=%s switches=%d', ev.switch.dp.id, len(self.switches))
+
+    @set_ev_cls(event.EventSwitchLeave)
+    def switch_leave_handler(self, ev):
+        self.switches.discard(ev.switch.dp.id)
+        self.datapaths.pop(ev.switch.dp.id, None)
+        self.barriers.forget(ev.switch.dp.id)
+        self.flow_mods.forget(ev.switch.dp.id)
+        self.prefix_guards.pop(ev.switch.dp.id, None)
+        self.event_log.info('switch_leave', 'switch=%s switches=%d', ev.switch.dp.id, len(self.switches))
+
+    @set_ev_cls(event.EventLinkAdd)
+    def link_add_handler(self, ev):
+        self.link_ports.add_link(ev.link)
+
+    @set_ev_cls(event.EventLinkDelete)
+    def link_delete_handler(self, ev):
+        self.link_ports.delete_link(ev.link)
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
+        self.warm_restart.switch_connected(datapath)
 
         # Install entry-miss flow entry
         match = parser.OFPMatch()
         actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
                                           ofproto.OFPCML_NO_BUFFER)]
         self.add_flow(datapath, 0, match, actions)
+        self.datapaths[datapath.id] = datapath
+
+        if CONF.routing.flow_hash_uplinks:
+            self.install_uplink_group(datapath)
+        elif CONF.routing.fast_failover:
+            self.install_failover_groups(datapath)
+
+        if CONF.routing.proactive:
+            self.install_proactive_flows(datapath)
+        self.flow_mods.flush()
+
+    # Select group with one bucket per uplink, the switch picks the bucket by hashing the flow
+    def install_uplink_group(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        switch_id = 'sw' + str(datapath.id)
+
+        uplinks = self.uplinks.get(switch_id)
+        if not uplinks:
+            return
+
+        # With fast_failover the switch only hashes over the buckets whose port is up
+        buckets = []
+        for uplink in uplinks:
+            port = self.switch_ports[(switch_id, uplink)]
+            watch_port = port if CONF.routing.fast_failover else ofproto.OFPP_ANY
+            buckets.append(parser.OFPBucket(weight=1, watch_port=watch_port, watch_group=ofproto.OFPG_ANY,
+                                            actions=[parser.OFPActionOutput(port)]))
+        self.flow_mods.send(datapath, parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD, ofproto.OFPGT_SELECT,
+                                                         UPLINK_GROUP, buckets))
+
+    # Fast-failover group for every uplink: the uplink while its port is up, otherwise the next
+    # uplink of the switch. Upward traffic can leave over any uplink, the downward routes of the
+    # two-level table have no loop-free alternative and keep plain output actions.
+    def install_failover_groups(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        switch_id = 'sw' + str(datapath.id)
+
+        uplinks = self.uplinks.get(switch_id, [])
+        if len(uplinks) < 2:
+            return
+
+        for i, uplink in enumerate(uplinks):
+            buckets = []
+            for hop in (uplink, uplinks[(i + 1) % len(uplinks)]):
+                port = self.switch_ports[(switch_id, hop)]
+                buckets.append(parser.OFPBucket(watch_port=port, watch_group=ofproto.OFPG_ANY,
+                                                actions=[parser.OFPActionOutput(port)]))
+            self.flow_mods.send(datapath, parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD, ofproto.OFPGT_FF,
+                                                             FAILOVER_GROUP_BASE + i, buckets))
+
+    def is_uplink(self, switch_id, next_hop):
+        return next_hop in self.uplinks.get(switch_id, ())
+
+    # Group action for IPv4 traffic going up to next_hop, None when it is not an uplink or no
+    # uplink groups are installed
+    def uplink_actions(self, parser, switch_id, next_hop):
+        if not self.is_uplink(switch_id, next_hop):
+            return None
+        if CONF.routing.flow_hash_uplinks:
+            return [parser.OFPActionGroup(UPLINK_GROUP)]
+        if CONF.routing.fast_failover and len(self.uplinks[switch_id]) > 1:
+            return [parser.OFPActionGroup(FAILOVER_GROUP_BASE + self.uplinks[switch_id].index(next_hop))]
+        return None
+
+    # Match and priority of the routing table entry the destination hits on a switch, for
+    # aggregate_flows: the prefix as a masked ipv4_dst in table 0, or the suffix under the mask
+    # 0.0.0.255 below all prefixes. A shorter prefix or a suffix only forwards correctly next to the
+    # longer prefixes of the switch, those are installed first as permanent guard entries. Returns
+    # None when the entry itself is already installed as a guard.
+    def aggregate_match(self, datapath, switch_id, destination):
+        parser = datapath.ofproto_parser
+        mask, key, route = self.routing_table.lookup_entry(switch_id, destination)
+        guards = self.prefix_guards.setdefault(datapath.id, set())
+        if mask in guards:
+            return None
+
+        for bucket_mask, routes in self.routing_table.prefixes.get(switch_id, ()):
+            if bucket_mask == mask:
+                break
+            if bucket_mask in guards:
+                continue
+            guards.add(bucket_mask)
+            for network, (hop, hop_ip_address, priority) in routes.items():
+                match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
+                                        ipv4_dst=(int_to_ip(network), int_to_ip(bucket_mask)))
+                actions = self.uplink_actions(parser, switch_id, hop) or \
+                    [parser.OFPActionOutput(self.switch_ports[(switch_id, hop)])]
+                self.add_flow(datapath, PREFIX_BASE_PRIORITY + prefix_length(bucket_mask), match, actions)
+
+        if mask is None:
+            return parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_dst=(int_to_ip(key), '0.0.0.255')), 1
+        return parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_dst=(int_to_ip(key), int_to_ip(mask))), \
+            PREFIX_BASE_PRIORITY + prefix_length(mask)
+
+    # Install the two-level routing table of the switch as an OpenFlow pipeline. Table 0 holds the
+    # prefixes as masked ipv4_dst matches, longer prefixes at higher priorities, and sends IPv4
+    # misses to table 1, which holds the suffixes as ipv4_dst matches under the mask 0.0.0.255.
+    # With flow_hash_uplinks, upward routes go to the uplink group and the suffixes are not needed.
+    def install_proactive_flows(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        switch_id = 'sw' + str(datapath.id)
+        num_flows = 0
+
+        for mask, routes in self.routing_table.prefixes.get(switch_id, ()):
+            for network, (hop, hop_ip_address, priority) in routes.items():
+                match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
+                                        ipv4_dst=(int_to_ip(network), int_to_ip(mask)))
+                actions = self.uplink_actions(parser, switch_id, hop) or \
+                    [parser.OFPActionOutput(self.switch_ports[(switch_id, hop)])]
+                self.add_flow(datapath, PREFIX_BASE_PRIORITY + prefix_length(mask), match, actions)
+                num_flows += 1
+
+        suffixes = self.routing_table.suffixes.get(switch_id, {})
+        if suffixes and CONF.routing.flow_hash_uplinks:
+            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP)
+            self.add_flow(datapath, 1, match, [parser.OFPActionGroup(UPLINK_GROUP)])
+            num_flows += 1
+        elif suffixes:
+            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP)
+            inst = [parser.OFPInstructionGotoTable(SUFFIX_TABLE)]
+            self.add_flow(datapath, 1, match, [], instructions=inst)
+
+            match = parser.OFPMatch()
+            actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
+            self.add_flow(datapath, 0, match, actions, table_id=SUFFIX_TABLE)
+
+            for host_id, (hop, hop_ip_address, priority) in suffixes.items():
+                match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
+                                        ipv4_dst=(int_to_ip(host_id), '0.0.0.255'))
+                actions = self.uplink_actions(parser, switch_id, hop) or \
+                    [parser.OFPActionOutput(self.switch_ports[(switch_id, hop)])]
+                self.add_flow(datapath, 1, match, actions, table_id=SUFFIX_TABLE)
+                num_flows += 1
+
+        self.event_log.info('proactive_flows_installed', 'switch=%s flows=%d', datapath.id, num_flows)
+
+    # Install the (in_port, eth_dst) entries, or the aggregate_match entries with aggregate_flows, of
+    # every switch the packet can cross on its way to dst_ip, from the server back to this switch,
+    # and send the packet out once the switches behind this one have confirmed theirs with a
+    # barrier, so that none of them sends it to the controller
+    def install_path(self, datapath, in_port, dst_ip, dst, data):
+        parser = datapath.ofproto_parser
+        destination = ip_to_int(dst_ip)
+
+        # Breadth-first over the routing table, each switch with the ports the packet can come in on.
+        # Upward traffic can take every uplink when they are hashed over.
+        hops = [('sw' + str(datapath.id), in_port)]
+        seen = set(hops)
+        entries = []
+        for switch_id, switch_in_port in hops:
+            hop, hop_ip_address, priority = self.routing_table.lookup(switch_id, destination)
+            actions = self.uplink_actions(parser, switch_id, hop) or \
+                [parser.OFPActionOutput(self.switch_ports[(switch_id, hop)])]
+            entries.append((switch_id, switch_in_port, actions, priority))
+            if hop_ip_address == dst_ip:
+                continue
+
+            next_switches = [hop]
+            if CONF.routing.flow_hash_uplinks and self.is_uplink(switch_id, hop):
+                next_switches = self.uplinks[switch_id]
+            for next_switch in next_switches:
+                next_hop = (next_switch, self.switch_ports[(next_switch, switch_id)])
+                if next_hop not in seen:
+                    seen.add(next_hop)
+                    hops.append(next_hop)
+
+        downstream = []
+        for switch_id, switch_in_port, actions, priority in reversed(entries):
+            switch_datapath = self.datapaths.get(topo.node_dpid(switch_id))
+            if switch_datapath is None:
+                continue
+            self.add_reactive_flow(switch_datapath, priority, switch_in_port, dst, destination, actions)
+            if switch_datapath is not datapath and switch_datapath not in downstream:
+                downstream.append(switch_datapath)
+        self.event_log.debug('path_installed', 'switch=%s dst_ip=%s switches=%d', datapath.id, dst_ip, len(entries))
+
+        out = parser.OFPPacketOut(datapath=datapath, in_port=in_port, actions=entries[0][2],
+                                  buffer_id=datapath.ofproto.OFP_NO_BUFFER, data=data)
+        self.barriers.send_after_barriers(downstream, out)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, ev):
+        self.barriers.barrier_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, ev):
+        self.warm_restart.flow_stats_reply(ev.msg)
+        self.flow_mods.flush()
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        self.warm_restart.flow_removed(ev.msg)
+
+    # Entry of a switch for the IPv4 packets of a flow, (in_port, eth_dst) or aggregated, expiring
+    # after the configured timeouts
+    def add_reactive_flow(self, datapath, priority, in_port, dst, destination, actions):
+        match = datapath.ofproto_parser.OFPMatch(in_port=in_port, eth_dst=dst)
+        if CONF.routing.aggregate_flows:
+            entry = self.aggregate_match(datapath, 'sw' + str(datapath.id), destination)
+            if entry is None:
+                return
+            match, priority = entry
+        self.add_flow(datapath, priority, match, actions, idle_timeout=CONF.routing.flow_idle_timeout,
+                      hard_timeout=CONF.routing.flow_hard_timeout)
 
     # Add a flow entry to the flow-table
-    def add_flow(self, datapath, priority, match, actions):
+    def add_flow(self, datapath, priority, match, actions, table_id=0, instructions=None, idle_timeout=0,
+                 hard_timeout=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         # Construct flow_mod message and send it
-        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
-        mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                match=match, instructions=inst)
-        datapath.send_msg(mod)
+        inst = instructions or [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        mod = parser.OFPFlowMod(datapath=datapath, table_id=table_id, priority=priority, match=match,
+                                instructions=inst, idle_timeout=idle_timeout, hard_timeout=hard_timeout)
+        self.flow_mods.send(datapath, mod)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
+        start = time.perf_counter()
+        self.handle_packet_in(ev)
+        self.flow_mods.flush()
+        self.loop_metrics.packet_in(start)
+
+    def handle_packet_in(self, ev):
         msg = ev.msg
         datapath = msg.datapath
         dpid = datapath.id
-        ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
+        pkt = packet_parser.parse(msg.data)
+        if pkt is None:
+            return
 
-        dst = eth.dst
-        src = eth.src
+        dst = pkt.eth_dst
+        src = pkt.eth_src
         dpid = datapath.id
-        self.mac_to_port.setdefault(dpid, {})
-
-        if eth.ethertype == ether_types.ETH_TYPE_ARP:
-            self.mac_to_port[dpid][src] = in_port
-            arp_pkt = pkt.get_protocol(arp.arp)
-            dst_ip = arp_pkt.dst_ip
-            type_of_eth = 'ARP'
-        elif eth.ethertype == ether_types.ETH_TYPE_IP:
-            ip_pkt = pkt.get_protocol(ipv4.ipv4)
-            dst_ip = ip_pkt.dst
-            type_of_eth = 'IP'
-        else:
+        dst_ip = pkt.dst_ip
+
+        if pkt.ethertype == ether_types.ETH_TYPE_ARP:
+            self.event_log.debug('packet_in_arp', 'switch=%s in_port=%s src=%s dst=%s dst_ip=%s', dpid, in_port, src,
+                                 dst, dst_ip)
+            self.arp.handle(datapath, in_port, pkt, msg.data)
+            return
+        elif pkt.ethertype != ether_types.ETH_TYPE_IP:
             return
 
-        print(f'[{dpid}][{in_port}][{type_of_eth}]{src}][{dst}][Destination Ip: {dst_ip}]')
+        self.event_log.debug('packet_in_ip', 'switch=%s in_port=%s src=%s dst=%s dst_ip=%s', dpid, in_port, src, dst,
+                             dst_ip)
 
-        next_dpid, next_ip_addr, priority = self.get_next_hop_for_current_switch(f'sw{dpid}', dst_ip)
+        if CONF.routing.path_install:
+            self.install_path(datapath, in_port, dst_ip, dst, msg.data)
+            return
 
-        print(f"sw{dpid} -> {next_dpid}, {next_ip_addr}")
+        next_dpid, next_ip_addr, priority = self.routing_table.lookup(f'sw{dpid}', ip_to_int(dst_ip))
 
         if next_ip_addr == dst_ip:
-            if dst in self.mac_to_port[dpid]:
-                out_port = self.mac_to_port[dpid][dst]
-            else:
-                out_port = ofproto.OFPP_FLOOD
+            out_port = self.switch_ports[(f'sw{dpid}', next_dpid)]
         else:
-            for link in self.switches_links:
-                if link.src.dpid == dpid and 'sw' + str(link.dst.dpid) == next_dpid:
-                    out_port = link.src.port_no
-                    break
-                elif link.dst.dpid == dpid and 'sw'+str(link.src.dpid) == next_dpid:
-                    out_port = link.dst.port_no
-                    break
+            out_port = self.link_ports.port(dpid, topo.node_dpid(next_dpid))
+            if out_port is None:
+                self.event_log.warning('no_link', 'switch=%s next_hop=%s dropping packet', dpid, next_dpid)
+                return
 
-        actions = [parser.OFPActionOutput(out_port)]
+        actions = self.uplink_actions(parser, f'sw{dpid}', next_dpid) or [parser.OFPActionOutput(out_port)]
 
-        if out_port != ofproto.OFPP_FLOOD and eth.ethertype == ether_types.ETH_TYPE_IP:
-            match = parser.OFPMatch(in_port=in_port, eth_dst=dst)
-            print(f'Adding flow: switch: {dpid} in_port: {in_port}, out_port: {out_port}, src: {src}, dst: {dst}')
-            self.add_flow(datapath, priority, match, actions)
+        self.event_log.debug('flow_added', 'switch=%s in_port=%s out_port=%s src=%s dst=%s', dpid, in_port, out_port,
+                             src, dst)
+        self.add_reactive_flow(datapath, priority, in_port, dst, ip_to_int(dst_ip), actions)
 
         out = parser.OFPPacketOut(datapath=datapath, in_port=in_port, actions=actions,
                                   buffer_id=datapath.ofproto.OFP_NO_BUFFER, data=msg.data)
 
-        datapath.send_msg(out)
+        self.flow_mods.send(datapath, out)
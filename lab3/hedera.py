@@ -0,0 +1,261 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Hedera-style scheduler for large flows, runs next to FTRouter:
+#   ryu-manager --config-file routing.conf --observe-links ft_routing.py hedera.py
+#
+# Every poll interval the scheduler reads the flow counters of the edge switches, takes the host
+# pairs sending above the elephant threshold, estimates their natural demand and places them with
+# Global First Fit on a core switch whose path still has room for them. Placed flows get exact
+# ipv4_src/ipv4_dst entries along the path, above the priorities FTRouter uses.
+#
+# Flows are counted per host pair. At the edge switches FTRouter's reactive entries match the
+# in_port of the sending host and the eth_dst of the receiver, the scheduler learns which IP
+# address belongs to that MAC address from the packet-ins. The prefix entries of the proactive
+# mode do not tell senders apart, so with proactive set only flows already placed are monitored.
+#
+# The demand estimation and the placement run on a worker thread, the entries of the placed flows
+# are installed once the result is back on the event loop.
+
+# !/usr/bin/env python3
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.controller.handler import set_ev_cls
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_3
+from ryu.lib.packet import ether_types
+
+import topo
+import packet_parser
+from routing_config import CONF
+from workers import WorkerPool
+from event_log import EventLog
+
+# Above the reactive entries and the proactive prefix entries of FTRouter
+ELEPHANT_PRIORITY = 100
+
+
+# Natural demand of every flow as a fraction of the host link: the rate the flow would reach if it
+# were only limited by the links of its sender and receiver, with max-min fair sharing between the
+# flows of a host. flows holds (src, dst) pairs, the demands are returned in the same order.
+def estimate_demands(flows):
+    demands = [0.0] * len(flows)
+    converged = [False] * len(flows)
+    by_src = {}
+    by_dst = {}
+    for i, (src, dst) in enumerate(flows):
+        by_src.setdefault(src, []).append(i)
+        by_dst.setdefault(dst, []).append(i)
+
+    changed = True
+    while changed:
+        changed = False
+
+        # Senders split what their converged flows leave over between the others
+        for indices in by_src.values():
+            unconverged = [i for i in indices if not converged[i]]
+            if not unconverged:
+                continue
+            share = (1.0 - sum(demands[i] for i in indices if converged[i])) / len(unconverged)
+            for i in unconverged:
+                if demands[i] != share:
+                    demands[i] = share
+                    changed = True
+
+        # Oversubscribed receivers limit the largest flows to an equal share of what the smaller
+        # flows leave over
+        for indices in by_dst.values():
+            if sum(demands[i] for i in indices) <= 1.0:
+                continue
+            limited = list(indices)
+            small = 0.0
+            share = 1.0 / len(limited)
+            while True:
+                smaller = [i for i in limited if demands[i] < share]
+                if not smaller:
+                    break
+                small += sum(demands[i] for i in smaller)
+                limited = [i for i in limited if demands[i] >= share]
+                share = (1.0 - small) / len(limited)
+            for i in limited:
+                if demands[i] != share or not converged[i]:
+                    demands[i] = share
+                    converged[i] = True
+                    changed = True
+
+    return demands
+
+
+class HederaScheduler(app_manager.RyuApp):
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    def __init__(self, *args, **kwargs):
+        super(HederaScheduler, self).__init__(*args, **kwargs)
+        self.topo_net = topo.Fattree(CONF.routing.fat_tree_k)
+        self.nodes = {node.id: node for node in self.topo_net.servers + self.topo_net.core_switches +
+                      self.topo_net.agg_switches + self.topo_net.edge_switches}
+        self.switch_ports = topo.switch_ports(list(self.nodes.values()))
+        self.port_to_server = {(switch_id, port): neighbour for (switch_id, neighbour), port in self.switch_ports.items()
+                               if self.nodes[neighbour].type == 'Server'}
+        self.server_by_ip = {server.ip_address: server for server in self.topo_net.servers}
+        self.edge_dpids = {topo.node_dpid(switch.id) for switch in self.topo_net.edge_switches}
+
+        self.datapaths = {}
+        self.mac_to_ip = {}
+        # (dpid, match) -> (byte count, duration) of the last poll
+        self.flow_counters = {}
+        # (src ip, dst ip) -> bytes per second, from the last poll
+        self.flow_rates = {}
+        # (src ip, dst ip) -> core switch id the flow is placed on
+        self.placements = {}
+        self.workers = WorkerPool('hedera')
+        self.event_log = EventLog('HederaScheduler')
+        self.monitor_thread = hub.spawn(self._monitor)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def state_change_handler(self, ev):
+        datapath = ev.datapath
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[datapath.id] = datapath
+        elif ev.state == DEAD_DISPATCHER:
+            self.datapaths.pop(datapath.id, None)
+
+    # Learn the IP address of every MAC address from the packets FTRouter handles
+    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    def _packet_in_handler(self, ev):
+        pkt = packet_parser.parse(ev.msg.data)
+        if pkt is not None and pkt.src_ip is not None:
+            self.mac_to_ip[pkt.eth_src] = pkt.src_ip
+
+    def _monitor(self):
+        while True:
+            self.schedule()
+            for dpid, datapath in list(self.datapaths.items()):
+                if dpid in self.edge_dpids:
+                    datapath.send_msg(datapath.ofproto_parser.OFPFlowStatsRequest(datapath))
+            hub.sleep(CONF.routing.hedera_poll_interval)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        switch_id = 'sw' + str(dpid)
+
+        rates = {}
+        for stat in ev.msg.body:
+            flow = self.flow_of_entry(switch_id, stat.match)
+            if flow is None:
+                continue
+
+            key = (dpid, stat.priority, tuple(sorted(stat.match.items())))
+            duration = stat.duration_sec + stat.duration_nsec / 1e9
+            last_bytes, last_duration = self.flow_counters.get(key, (0, 0.0))
+            self.flow_counters[key] = (stat.byte_count, duration)
+            if duration > last_duration and stat.byte_count >= last_bytes:
+                rates[flow] = rates.get(flow, 0.0) + (stat.byte_count - last_bytes) / (duration - last_duration)
+        self.flow_rates.update(rates)
+
+    # Host pair an edge switch entry counts, None for entries that do not belong to a single pair.
+    # Placed flows are counted at the edge switch of their sender only.
+    def flow_of_entry(self, switch_id, match):
+        if 'ipv4_src' in match and 'ipv4_dst' in match:
+            src_ip = match['ipv4_src']
+            if src_ip not in self.server_by_ip or self.edge_of(src_ip).id != switch_id:
+                return None
+            return src_ip, match['ipv4_dst']
+
+        server_id = self.port_to_server.get((switch_id, match.get('in_port')))
+        dst_ip = self.mac_to_ip.get(match.get('eth_dst'))
+        if server_id is None or dst_ip is None:
+            return None
+        return self.nodes[server_id].ip_address, dst_ip
+
+    # Flows between pods crossing the elephant threshold
+    def elephant_flows(self):
+        threshold = CONF.routing.hedera_elephant_threshold * CONF.routing.link_bandwidth * 1e6 / 8
+        return [(src_ip, dst_ip) for (src_ip, dst_ip), rate in sorted(self.flow_rates.items())
+                if rate >= threshold and src_ip in self.server_by_ip and dst_ip in self.server_by_ip and
+                self.pod_of(src_ip) != self.pod_of(dst_ip)]
+
+    def pod_of(self, server_ip):
+        return server_ip.split('.')[1]
+
+    def edge_of(self, server_ip):
+        return self.server_by_ip[server_ip].edges[0].left_node
+
+    # Switches of the path between two servers of different pods over the given core switch
+    def core_path(self, src_ip, dst_ip, core_id):
+        core = self.nodes[core_id]
+        src_edge = self.edge_of(src_ip)
+        dst_edge = self.edge_of(dst_ip)
+        src_agg = next(agg for agg in topo.uplink_neighbours(src_edge) if agg.is_neighbor(core))
+        dst_agg = next(agg for agg in topo.uplink_neighbours(dst_edge) if agg.is_neighbor(core))
+        return [src_edge.id, src_agg.id, core_id, dst_agg.id, dst_edge.id]
+
+    def schedule(self):
+        self.workers.submit(self.place, (self.elephant_flows(), dict(self.placements)), self.apply_placements)
+        self.flow_rates = {}
+
+    # Global First Fit: every elephant keeps its core switch while the path has room for its demand,
+    # otherwise it goes to the first core switch whose path has. Flows that fit nowhere stay on the
+    # routes of FTRouter. Only reads the topology, so that it can run on a worker.
+    def place(self, flows, current):
+        reserved = {}
+        placements = {}
+
+        for flow, demand in zip(flows, estimate_demands(flows)):
+            candidates = [switch.id for switch in self.topo_net.core_switches]
+            if flow in current:
+                candidates.insert(0, current[flow])
+
+            for core_id in candidates:
+                path = self.core_path(flow[0], flow[1], core_id)
+                links = list(zip(path, path[1:]))
+                if all(reserved.get(link, 0.0) + demand <= 1.0 for link in links):
+                    for link in links:
+                        reserved[link] = reserved.get(link, 0.0) + demand
+                    placements[flow] = core_id
+                    break
+        return placements
+
+    def apply_placements(self, placements):
+        for flow, core_id in placements.items():
+            if self.placements.get(flow) != core_id:
+                self.event_log.info('elephant_placed', 'src_ip=%s dst_ip=%s core=%s', flow[0], flow[1], core_id)
+                self.install_path(flow, self.core_path(flow[0], flow[1], core_id))
+
+        self.placements = placements
+
+    # Exact entries for the host pair on every switch of the path, with the server port at the end,
+    # installed from the receiver back so that no switch sends the flow to one without its entry.
+    # They expire once the flow has been idle for two poll intervals.
+    def install_path(self, flow, path):
+        src_ip, dst_ip = flow
+        hops = path[1:] + [self.server_by_ip[dst_ip].id]
+        for switch_id, next_hop in reversed(list(zip(path, hops))):
+            datapath = self.datapaths.get(topo.node_dpid(switch_id))
+            if datapath is None:
+                continue
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+
+            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_src=src_ip, ipv4_dst=dst_ip)
+            actions = [parser.OFPActionOutput(self.switch_ports[(switch_id, next_hop)])]
+            inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+            datapath.send_msg(parser.OFPFlowMod(datapath=datapath, priority=ELEPHANT_PRIORITY, match=match,
+                                                instructions=inst,
+                                                idle_timeout=2 * CONF.routing.hedera_poll_interval))
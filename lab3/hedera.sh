@@ -0,0 +1,8 @@
+sv5 iperf -s &> sv5.log &
+sv7 iperf -s &> sv7.log &
+sv9 iperf -s &> sv9.log &
+sv11 iperf -s &> sv11.log &
+sv1 iperf -c sv5 -t 60 &> sv1.log &
+sv2 iperf -c sv7 -t 60 &> sv2.log &
+sv3 iperf -c sv9 -t 60 &> sv3.log &
+sv4 iperf -c sv11 -t 60 &> sv4.log &
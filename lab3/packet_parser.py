@@ -0,0 +1,71 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Packet-in parser of the controllers. ryu.lib.packet decodes every header of the frame into
+# objects, the controllers only need the ethertype, the MAC addresses, the addresses of the ARP
+# or IPv4 header and the ARP opcode. parse reads those straight from the buffer, in the same text
+# form ryu uses.
+
+# !/usr/bin/env python3
+import collections
+import socket
+import struct
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+
+ARP_REQUEST = 1
+ARP_REPLY = 2
+
+ETH_HEADER_LENGTH = 14
+ARP_OPCODE_OFFSET = ETH_HEADER_LENGTH + 6
+# Sender and target protocol address of an Ethernet/IPv4 ARP packet
+ARP_SRC_IP_OFFSET = ETH_HEADER_LENGTH + 14
+ARP_DST_IP_OFFSET = ETH_HEADER_LENGTH + 24
+# Source and destination address of the IPv4 header
+IPV4_SRC_OFFSET = ETH_HEADER_LENGTH + 12
+IPV4_DST_OFFSET = ETH_HEADER_LENGTH + 16
+
+UINT16 = struct.Struct('!H')
+
+# src_ip and dst_ip are None for frames that are neither ARP nor IPv4, arp_op for frames that are
+# not ARP
+PacketInfo = collections.namedtuple('PacketInfo', ['eth_dst', 'eth_src', 'ethertype', 'src_ip', 'dst_ip', 'arp_op'])
+
+
+# Fields of an Ethernet frame, None when the frame is too short for the headers it announces
+def parse(data):
+    view = memoryview(data)
+    if len(view) < ETH_HEADER_LENGTH:
+        return None
+    ethertype = UINT16.unpack_from(view, 12)[0]
+
+    arp_op = None
+    if ethertype == ETH_TYPE_ARP:
+        src_offset, dst_offset = ARP_SRC_IP_OFFSET, ARP_DST_IP_OFFSET
+    elif ethertype == ETH_TYPE_IP:
+        src_offset, dst_offset = IPV4_SRC_OFFSET, IPV4_DST_OFFSET
+    else:
+        return PacketInfo(view[0:6].hex(':'), view[6:12].hex(':'), ethertype, None, None, None)
+
+    if len(view) < dst_offset + 4:
+        return None
+    if ethertype == ETH_TYPE_ARP:
+        arp_op = UINT16.unpack_from(view, ARP_OPCODE_OFFSET)[0]
+    return PacketInfo(view[0:6].hex(':'), view[6:12].hex(':'), ethertype,
+                      socket.inet_ntoa(view[src_offset:src_offset + 4]),
+                      socket.inet_ntoa(view[dst_offset:dst_offset + 4]), arp_op)
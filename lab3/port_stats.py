@@ -0,0 +1,190 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Port statistics telemetry shared by the controllers. The apps list it in their _CONTEXTS, so
+# ryu-manager starts a single instance and hands it to every app as kwargs['port_stats'].
+#
+# Every port_stats_interval seconds all switches are asked for their port counters. The byte
+# counters are turned into rx/tx rates and the last port_stats_history rates of every port are
+# kept in a ring buffer. The same poll asks for the table counters, flow_table_occupancy() gives the
+# number of entries in every flow table of a switch. Apps read them with rates(), utilization(),
+# history(), flow_table_occupancy() and snapshot(); with port_stats_file set the port snapshot and
+# the flow table occupancy are also written to that file after every poll, as Prometheus text when
+# it ends in .prom and as JSON otherwise.
+
+# !/usr/bin/env python3
+import collections
+import json
+import os
+import time
+
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.controller.handler import set_ev_cls
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_3
+
+from routing_config import CONF
+from workers import WorkerPool
+
+PortSample = collections.namedtuple('PortSample', ['time', 'rx_bps', 'tx_bps'])
+
+PROMETHEUS_METRICS = [
+    ('rx_bps', 'port_rx_bits_per_second', 'Receive rate of the switch port'),
+    ('tx_bps', 'port_tx_bits_per_second', 'Transmit rate of the switch port'),
+    ('utilization', 'port_utilization', 'Larger of the receive and transmit rate as a fraction of the link bandwidth'),
+]
+
+
+class PortStatsMonitor(app_manager.RyuApp):
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    def __init__(self, *args, **kwargs):
+        super(PortStatsMonitor, self).__init__(*args, **kwargs)
+        self.datapaths = {}
+        # (dpid, port) -> (rx bytes, tx bytes, port uptime) of the last reply
+        self.counters = {}
+        # (dpid, port) -> ring buffer of PortSample
+        self.samples = {}
+        # dpid -> table id -> active entries, tables without entries are left out
+        self.flow_tables = {}
+        self.capacity = CONF.routing.link_bandwidth * 1e6
+        self.monitor_thread = None
+        self.workers = WorkerPool('port_stats')
+        if CONF.routing.port_stats_interval > 0:
+            self.monitor_thread = hub.spawn(self._monitor)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def state_change_handler(self, ev):
+        datapath = ev.datapath
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[datapath.id] = datapath
+        elif ev.state == DEAD_DISPATCHER:
+            self.datapaths.pop(datapath.id, None)
+            self.flow_tables.pop(datapath.id, None)
+
+    def _monitor(self):
+        while True:
+            for datapath in list(self.datapaths.values()):
+                ofproto = datapath.ofproto
+                parser = datapath.ofproto_parser
+                datapath.send_msg(parser.OFPPortStatsRequest(datapath, 0, ofproto.OFPP_ANY))
+                datapath.send_msg(parser.OFPTableStatsRequest(datapath, 0))
+            hub.sleep(CONF.routing.port_stats_interval)
+            if CONF.routing.port_stats_file:
+                self.workers.submit(write_snapshot_file, (CONF.routing.port_stats_file, self.snapshot(),
+                                                          self.flow_table_occupancy()))
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def port_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        max_port = ev.msg.datapath.ofproto.OFPP_MAX
+        now = time.time()
+
+        for stat in ev.msg.body:
+            if stat.port_no > max_port:
+                continue
+            key = (dpid, stat.port_no)
+            uptime = stat.duration_sec + stat.duration_nsec / 1e9
+            last = self.counters.get(key)
+            self.counters[key] = (stat.rx_bytes, stat.tx_bytes, uptime)
+
+            # Counters restart with the port, only take rates over an interval both replies cover
+            if last is None or uptime <= last[2] or stat.rx_bytes < last[0] or stat.tx_bytes < last[1]:
+                continue
+            interval = uptime - last[2]
+            if key not in self.samples:
+                self.samples[key] = collections.deque(maxlen=CONF.routing.port_stats_history)
+            self.samples[key].append(PortSample(now, (stat.rx_bytes - last[0]) * 8 / interval,
+                                                (stat.tx_bytes - last[1]) * 8 / interval))
+
+    @set_ev_cls(ofp_event.EventOFPTableStatsReply, MAIN_DISPATCHER)
+    def table_stats_reply_handler(self, ev):
+        self.flow_tables[ev.msg.datapath.id] = {stat.table_id: stat.active_count for stat in ev.msg.body
+                                                if stat.active_count > 0}
+
+    # Latest (rx, tx) rate of a port in bit/s, None before two replies have come in
+    def rates(self, dpid, port):
+        samples = self.samples.get((dpid, port))
+        if not samples:
+            return None
+        return samples[-1].rx_bps, samples[-1].tx_bps
+
+    # Larger of the latest rx and tx rate of a port as a fraction of the link bandwidth
+    def utilization(self, dpid, port):
+        rates = self.rates(dpid, port)
+        if rates is None:
+            return None
+        return max(rates) / self.capacity
+
+    def history(self, dpid, port):
+        return list(self.samples.get((dpid, port), ()))
+
+    # table id -> entries of a switch from the last poll, or dpid -> table id -> entries of all of them
+    def flow_table_occupancy(self, dpid=None):
+        if dpid is None:
+            return {dpid: dict(tables) for dpid, tables in self.flow_tables.items()}
+        return dict(self.flow_tables.get(dpid, {}))
+
+    # dpid -> port -> latest rates and utilization
+    def snapshot(self):
+        snapshot = {}
+        for (dpid, port), samples in self.samples.items():
+            sample = samples[-1]
+            snapshot.setdefault(dpid, {})[port] = {
+                'time': sample.time,
+                'rx_bps': sample.rx_bps,
+                'tx_bps': sample.tx_bps,
+                'utilization': max(sample.rx_bps, sample.tx_bps) / self.capacity,
+            }
+        return snapshot
+
+    def write_snapshot(self, path):
+        write_snapshot_file(path, self.snapshot(), self.flow_table_occupancy())
+
+
+# Write the snapshot to a temporary file first, readers never see a half-written one
+def write_snapshot_file(path, snapshot, flow_tables):
+    if path.endswith('.prom'):
+        text = prometheus_text(snapshot, flow_tables)
+    else:
+        text = json.dumps({'ports': {str(dpid): ports for dpid, ports in snapshot.items()},
+                           'flow_tables': {str(dpid): tables for dpid, tables in flow_tables.items()}},
+                          indent=2, sort_keys=True)
+
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def prometheus_text(snapshot, flow_tables=None):
+    lines = []
+    for field, metric, description in PROMETHEUS_METRICS:
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} gauge')
+        for dpid, ports in sorted(snapshot.items()):
+            for port, values in sorted(ports.items()):
+                lines.append(f'{metric}{{dpid="{dpid}",port="{port}"}} {values[field]}')
+
+    if flow_tables is not None:
+        lines.append('# HELP flow_table_entries Active entries of the flow table')
+        lines.append('# TYPE flow_table_entries gauge')
+        for dpid, tables in sorted(flow_tables.items()):
+            for table_id, entries in sorted(tables.items()):
+                lines.append(f'flow_table_entries{{dpid="{dpid}",table="{table_id}"}} {entries}')
+    return '\n'.join(lines) + '\n'
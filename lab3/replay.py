@@ -0,0 +1,302 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Replays packet-ins into LearningSwitch, SPRouter or FTRouter without Mininet or Open vSwitch. The
+# app is connected to a fake datapath per switch of a fat-tree with k ports per switch, is told
+# about the links between them and is then handed the packet-ins the edge switches send for new
+# flows between random pairs of servers: the ARP request of the sender and the first IPv4 packet,
+# that one --duplicates times as when more packets of the flow arrive before its entry. There is
+# no data plane, the packet-ins of the switches further along the path are not generated. Barrier
+# requests are answered once the handler has returned.
+#
+# Reports the packet-ins handled per second, the percentiles of the handler latency and the
+# messages the app sent to the switches. With --json the results are printed as one JSON object per
+# run, --min-rate makes the run fail below a rate, to catch regressions without a testbed, and
+# --profile shows where the handlers spend their time.
+#
+#   python3 replay.py --app sp -k 4 8 --flows 2000 --set path_install=true --set aggregate_flows=true
+
+# !/usr/bin/env python3
+import argparse
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import random
+import socket
+import struct
+import sys
+import time
+
+from ryu.controller import ofp_event
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+from ryu.topology import event
+
+import topo
+import packet_parser
+from arp_responder import ARP_HEADER, mac_to_bytes
+from routing_config import CONF
+from workers import percentile
+from port_stats import PortStatsMonitor
+from sp_routing import SPRouter
+from ft_routing import FTRouter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lab1'))
+from learning_switch import LearningSwitch
+
+APPS = {'ls': LearningSwitch, 'sp': SPRouter, 'ft': FTRouter}
+
+# OpenFlow message types counted per run
+MESSAGE_TYPES = {
+    ofproto_v1_3.OFPT_FLOW_MOD: 'flow_mods',
+    ofproto_v1_3.OFPT_GROUP_MOD: 'group_mods',
+    ofproto_v1_3.OFPT_PACKET_OUT: 'packet_outs',
+    ofproto_v1_3.OFPT_BARRIER_REQUEST: 'barriers',
+}
+
+OFP_HEADER = struct.Struct('!BBHI')
+
+LinkEnd = collections.namedtuple('LinkEnd', ['dpid', 'port_no'])
+Link = collections.namedtuple('Link', ['src', 'dst'])
+
+
+# Datapath that counts what the app sends it, by OpenFlow message type, and keeps the xids of its
+# barrier requests to answer them
+class FakeDatapath:
+    def __init__(self, dpid):
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.xid = 0
+        self.counters = collections.Counter()
+        self.barriers = []
+
+    def set_xid(self, msg):
+        self.xid += 1
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg):
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+        return self.send(msg.buf)
+
+    def send(self, buf):
+        self.counters['writes'] += 1
+        self.counters['bytes'] += len(buf)
+        offset = 0
+        while offset < len(buf):
+            _, msg_type, length, xid = OFP_HEADER.unpack_from(buf, offset)
+            self.counters[MESSAGE_TYPES.get(msg_type, 'other')] += 1
+            if msg_type == ofproto_v1_3.OFPT_BARRIER_REQUEST:
+                self.barriers.append(xid)
+            offset += length
+        return True
+
+
+def fat_tree_switches(ft_topo):
+    return ft_topo.core_switches + ft_topo.agg_switches + ft_topo.edge_switches
+
+
+# Connect a fake datapath per switch and report every link between two switches in both directions
+def connect(app, ft_topo, switch_ports):
+    datapaths = {}
+    for switch in fat_tree_switches(ft_topo):
+        datapath = FakeDatapath(topo.node_dpid(switch.id))
+        datapaths[switch.id] = datapath
+        app.switch_features_handler(ofp_event.EventOFPSwitchFeatures(
+            ofproto_v1_3_parser.OFPSwitchFeatures(datapath, datapath_id=datapath.id)))
+
+    if hasattr(app, 'link_add_handler'):
+        for (switch_id, neighbour_id), port in switch_ports.items():
+            if neighbour_id in datapaths:
+                link = Link(LinkEnd(topo.node_dpid(switch_id), port),
+                            LinkEnd(topo.node_dpid(neighbour_id), switch_ports[(neighbour_id, switch_id)]))
+                app.link_add_handler(event.EventLinkAdd(link))
+    return datapaths
+
+
+# Answer the barrier requests the switches got, the app may send more messages on the replies
+def answer_barriers(app, datapaths):
+    while any(datapath.barriers for datapath in datapaths):
+        for datapath in datapaths:
+            xids, datapath.barriers = datapath.barriers, []
+            for xid in xids:
+                reply = ofproto_v1_3_parser.OFPBarrierReply(datapath)
+                reply.xid = xid
+                app.barrier_reply_handler(ofp_event.EventOFPBarrierReply(reply))
+
+
+def arp_request(src, dst):
+    src_mac = mac_to_bytes(topo.server_mac(src.ip_address))
+    return b'\xff' * 6 + src_mac + packet_parser.UINT16.pack(packet_parser.ETH_TYPE_ARP) + \
+        ARP_HEADER.pack(1, packet_parser.ETH_TYPE_IP, 6, 4, packet_parser.ARP_REQUEST, src_mac,
+                        socket.inet_aton(src.ip_address), b'\x00' * 6, socket.inet_aton(dst.ip_address))
+
+
+# IPv4 header of a TCP segment without payload, followed by the ports and sequence number
+def ipv4_packet(src, dst, src_port):
+    header = struct.pack('!6s6sHBBHHHBBH4s4sHHI', mac_to_bytes(topo.server_mac(dst.ip_address)),
+                         mac_to_bytes(topo.server_mac(src.ip_address)), packet_parser.ETH_TYPE_IP, 0x45, 0, 40, 0,
+                         0, 64, 6, 0, socket.inet_aton(src.ip_address), socket.inet_aton(dst.ip_address),
+                         src_port, 5001, 0)
+    return header + b'\x00' * 12
+
+
+# (switch id, in_port, frame) of the packet-ins of num_flows flows between distinct random servers
+def packet_in_stream(ft_topo, switch_ports, num_flows, duplicates, seed):
+    rng = random.Random(seed)
+    servers = ft_topo.servers
+    stream = []
+    for flow in range(num_flows):
+        src, dst = rng.sample(servers, 2)
+        edge = src.edges[0].left_node
+        in_port = switch_ports[(edge.id, src.id)]
+        stream.append((edge.id, in_port, arp_request(src, dst)))
+        frame = ipv4_packet(src, dst, 1024 + flow % 60000)
+        stream.extend((edge.id, in_port, frame) for _ in range(duplicates))
+    return stream
+
+
+def replay(options, k):
+    CONF.set_override('fat_tree_k', k, group='routing')
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        ft_topo = topo.Fattree(k)
+        app = APPS[options.app](port_stats=PortStatsMonitor())
+    switch_ports = topo.switch_ports(fat_tree_switches(ft_topo))
+
+    start_time = time.perf_counter()
+    datapaths = connect(app, ft_topo, switch_ports)
+    connect_time = time.perf_counter() - start_time
+    connect_counters = sum((datapath.counters for datapath in datapaths.values()), collections.Counter())
+    for datapath in datapaths.values():
+        datapath.counters.clear()
+
+    stream = packet_in_stream(ft_topo, switch_ports, options.flows, options.duplicates, options.seed)
+    events = []
+    for switch_id, in_port, frame in stream:
+        datapath = datapaths[switch_id]
+        msg = ofproto_v1_3_parser.OFPPacketIn(datapath, buffer_id=ofproto_v1_3.OFP_NO_BUFFER, total_len=len(frame),
+                                              reason=ofproto_v1_3.OFPR_NO_MATCH, table_id=0, cookie=0,
+                                              match=ofproto_v1_3_parser.OFPMatch(in_port=in_port), data=frame)
+        events.append(ofp_event.EventOFPPacketIn(msg))
+
+    has_barriers = hasattr(app, 'barrier_reply_handler')
+    latencies = []
+    start_time = time.perf_counter()
+    for ev in events:
+        handler_start = time.perf_counter()
+        app._packet_in_handler(ev)
+        latencies.append(time.perf_counter() - handler_start)
+        if has_barriers:
+            answer_barriers(app, datapaths.values())
+    total_time = time.perf_counter() - start_time
+
+    counters = sum((datapath.counters for datapath in datapaths.values()), collections.Counter())
+    result = {
+        'app': options.app,
+        'k': k,
+        'packet_ins': len(events),
+        'connect_s': connect_time,
+        'connect_flow_mods': connect_counters['flow_mods'],
+        'total_s': total_time,
+        'events_per_s': len(events) / total_time,
+        'handler_events_per_s': len(events) / sum(latencies),
+    }
+    for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)):
+        result[f'latency_{name}_us'] = percentile(latencies, fraction) * 1e6
+    for name in ['flow_mods', 'group_mods', 'packet_outs', 'barriers', 'other', 'writes', 'bytes']:
+        result[name] = counters[name]
+    return result
+
+
+def print_result(result):
+    print(f'{result["app"] + "@k=" + str(result["k"]):<10} {result["packet_ins"]:>8} packet-ins '
+          f'{result["events_per_s"]:>10.0f} events/s  latency p50 {result["latency_p50_us"]:.0f} '
+          f'p90 {result["latency_p90_us"]:.0f} p99 {result["latency_p99_us"]:.0f} '
+          f'max {result["latency_max_us"]:.0f} us')
+    print(f'{"":<10} flow-mods {result["flow_mods"]} group-mods {result["group_mods"]} '
+          f'packet-outs {result["packet_outs"]} barriers {result["barriers"]} writes {result["writes"]} '
+          f'bytes {result["bytes"]}, at connect {result["connect_flow_mods"]} flow-mods in '
+          f'{result["connect_s"]:.3f} s')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay generated packet-ins into a lab controller app and '
+                                                 'measure its handlers')
+
+    parser.add_argument('--app', dest='app', choices=sorted(APPS), default='sp',
+                        help='LearningSwitch (ls), SPRouter (sp) or FTRouter (ft)')
+
+    parser.add_argument('-k', '--scales', dest='scales', type=int, nargs='+', default=[4],
+                        help='Fat-tree port counts to run at')
+
+    parser.add_argument('--flows', dest='flows', type=int, default=2000,
+                        help='New flows between random pairs of servers')
+
+    parser.add_argument('--duplicates', dest='duplicates', type=int, default=1,
+                        help='Packet-ins of the first IPv4 packet of every flow')
+
+    parser.add_argument('--seed', dest='seed', type=int, default=1,
+                        help='Seed of the server pairs')
+
+    parser.add_argument('--config-file', dest='config_file', default=None,
+                        help='Options of the apps, as given to ryu-manager')
+
+    parser.add_argument('--set', dest='overrides', action='append', default=[], metavar='OPTION=VALUE',
+                        help='Set an option of the [routing] section, can be repeated')
+
+    parser.add_argument('--json', dest='json', action='store_true',
+                        help='Print the results as one JSON object per run')
+
+    parser.add_argument('--min-rate', dest='min_rate', type=float, default=0,
+                        help='Exit with an error when a run handles fewer packet-ins per second')
+
+    parser.add_argument('--profile', dest='profile', type=int, default=0, metavar='N',
+                        help='Profile the runs and print the N functions they spend the most time in')
+
+    return parser.parse_args()
+
+
+def main(options):
+    CONF(args=[], default_config_files=[options.config_file] if options.config_file else [])
+    for override in options.overrides:
+        name, value = override.split('=', 1)
+        CONF.set_override(name, value, group='routing')
+
+    failed = False
+    for k in options.scales:
+        profile = cProfile.Profile() if options.profile else None
+        if profile is not None:
+            profile.enable()
+        result = replay(options, k)
+        if profile is not None:
+            profile.disable()
+            pstats.Stats(profile).sort_stats('tottime').print_stats(options.profile)
+        if options.json:
+            print(json.dumps(result))
+        else:
+            print_result(result)
+        failed = failed or result['events_per_s'] < options.min_rate
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args()))
@@ -0,0 +1,101 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Options shared by the lab3 controllers. They are read from the [routing] section of the file
+# given to ryu-manager with --config-file, see routing.conf.
+
+from ryu import cfg
+
+CONF = cfg.CONF
+CONF.register_opts([
+    cfg.IntOpt('fat_tree_k', default=4,
+               help='Number of ports per switch of the fat-tree, has to match the k fat-tree.py was started with'),
+    cfg.BoolOpt('print_routing_tables', default=False,
+                help='Log the routing tables computed at start-up'),
+    cfg.BoolOpt('proactive', default=False,
+                help='Install the IPv4 forwarding entries for every server when a switch connects, '
+                     'so that only ARP reaches the controller. FTRouter installs its two-level routing '
+                     'table as a prefix table and a suffix table'),
+    cfg.BoolOpt('ecmp', default=False,
+                help='SPRouter: keep all equal-cost next hops and spread the flows to a server over them '
+                     'with select groups, instead of following a single shortest path'),
+    cfg.BoolOpt('flow_hash_uplinks', default=False,
+                help='FTRouter: send upward traffic to a select group over all uplinks, so that the switch '
+                     'spreads flows by hashing them, instead of choosing the uplink by the host id suffix'),
+    cfg.BoolOpt('path_install', default=False,
+                help='On the packet-in of a new IPv4 flow, install its entries on every switch of the path '
+                     'at once, receiver side first, and send the packet out after a barrier'),
+    cfg.BoolOpt('aggregate_flows', default=False,
+                help='Match the entries on the destination only, as wide as the forwarding decision allows: '
+                     'the /24 of the destination edge switch or the two-level table prefix in the routers, '
+                     'eth_dst in the learning switch, instead of one entry per in_port and eth_dst'),
+    cfg.IntOpt('flow_idle_timeout', default=0,
+               help='Idle timeout in seconds of the entries the routers install on packet-in, 0 for none. The '
+                    'learning switch uses mac_aging_time'),
+    cfg.IntOpt('flow_hard_timeout', default=0,
+               help='Hard timeout in seconds of the entries installed on packet-in, 0 for none'),
+    cfg.BoolOpt('fast_failover', default=False,
+                help='Install fast-failover groups that move traffic to a precomputed backup next hop in '
+                     'the switch as soon as the port of the primary one goes down'),
+    cfg.IntOpt('link_bandwidth', default=15,
+               help='Bandwidth of the fat-tree links in Mbit/s, as set in fat-tree.py'),
+    cfg.IntOpt('hedera_poll_interval', default=5,
+               help='Hedera scheduler: seconds between two polls of the edge switch flow counters'),
+    cfg.FloatOpt('hedera_elephant_threshold', default=0.1,
+                 help='Hedera scheduler: rate, as a fraction of the link bandwidth, above which a flow '
+                      'is scheduled as an elephant flow'),
+    cfg.IntOpt('port_stats_interval', default=0,
+               help='Seconds between two port statistics polls of every switch, 0 disables the polling'),
+    cfg.IntOpt('port_stats_history', default=60,
+               help='Number of rate samples kept per switch port'),
+    cfg.StrOpt('port_stats_file', default='',
+               help='File the port rates and flow table occupancy are written to after every poll, as Prometheus text when '
+                    'the name ends in .prom and as JSON otherwise'),
+    cfg.IntOpt('worker_threads', default=2,
+               help='Threads per app for the work moved off the event loop, such as recomputing routes after a '
+                    'link event, 0 runs it in the handlers'),
+    cfg.IntOpt('worker_queue_size', default=16,
+               help='Jobs that may wait for a worker thread, further jobs run in the handlers'),
+    cfg.IntOpt('loop_metrics_interval', default=0,
+               help='Seconds between two prints of the packet-in latency and event queue depth, 0 disables them'),
+    cfg.BoolOpt('flow_mod_batching', default=True,
+                help='Queue the messages a handler sends to a switch and write them as one buffer at the end of '
+                     'the handler, instead of one write per message'),
+    cfg.FloatOpt('flow_mod_dedup_window', default=0.5,
+                 help='Seconds within which an add flow-mod identical to one already sent to the switch is '
+                      'dropped, 0 sends every flow-mod'),
+    cfg.StrOpt('log_level', default='INFO',
+               help='Level of the events the controllers log: DEBUG adds an event per packet-in and flow entry, '
+                    'INFO the switch and route changes, WARNING only dropped packets'),
+    cfg.IntOpt('log_rate_limit', default=20,
+               help='Events of one kind logged per second at most, the others are only counted, 0 for no limit'),
+    cfg.StrOpt('log_file', default='',
+               help='File the events are appended to, stderr when empty'),
+    cfg.IntOpt('log_buffer_size', default=10000,
+               help='Events that may wait for the writer thread, further events are dropped'),
+    cfg.StrOpt('state_file', default='',
+               help='File the learned state and the installed flow entries are written to and read back from '
+                    'on a restart, so that switches keep or get back their entries, empty for none'),
+    cfg.IntOpt('state_snapshot_interval', default=30,
+               help='Seconds between two writes of state_file, 0 only writes it when the controller stops'),
+    cfg.IntOpt('mac_table_size', default=4096,
+               help='Learning switch: addresses per switch MAC table, the least recently seen one is evicted '
+                    'for a new one, 0 for no limit'),
+    cfg.IntOpt('mac_aging_time', default=300,
+               help='Learning switch: seconds after which an address that was not seen is forgotten, also the '
+                    'idle timeout of the entries towards it, 0 to keep addresses until evicted'),
+], group='routing')
@@ -16,7 +16,7 @@
 # under the License.
 
 # !/usr/bin/env python3
-import collections
+import time
 
 from ryu.base import app_manager
 from ryu.controller import mac_to_port
@@ -25,36 +25,65 @@ from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.mac import haddr_to_bin
-from ryu.lib.packet import packet
-from ryu.lib.packet import ipv4
-from ryu.lib.packet import arp
-from ryu.lib.packet import ethernet
 from ryu.lib.packet import ether_types
+from ryu.lib import hub
 
 from ryu.topology import event, switches
-from ryu.topology.api import get_switch, get_link
 from ryu.app.wsgi import ControllerBase
 
 import topo
-import copy
+from routing_config import CONF
+from topology_index import PortIndex, ShortestPathTrees
+from port_stats import PortStatsMonitor
+from barriers import BarrierGate
+from flow_mods import FlowModBatcher
+import packet_parser
+from arp_responder import ArpResponder
+from workers import WorkerPool, LoopMetrics
+from event_log import EventLog
+from warm_restart import WarmRestart
+from two_level_routing import MASK_24, int_to_ip, ip_to_int
+
+# Fast-failover groups are numbered after the ECMP group of the same destination plus this offset
+FAILOVER_GROUP_BASE = 1 << 16
+
+# Seconds after which the roots of a failed route recomputation are submitted again
+ROUTES_RETRY_DELAY = 1
 
 
 class SPRouter(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _CONTEXTS = {'port_stats': PortStatsMonitor}
 
     def __init__(self, *args, **kwargs):
         super(SPRouter, self).__init__(*args, **kwargs)
-        self.topo_raw_switches = []
-        self.topo_raw_links = []
-        self.switches = []
-        self.switches_links = []
-        self.datapath_list = []
-        self.mac_to_port = {}
-        self.fat_tree_topo = topo.Fattree(4)
+        self.switches = set()
+        self.datapaths = {}
+        # Destination ip -> MAC addresses the reactive entries towards it match on
+        self.server_macs = {}
+        # dpid -> ids of the ECMP groups installed on the switch
+        self.ecmp_groups = {}
+        # dpid -> fast-failover group id -> (primary, backup) node indices it outputs to
+        self.failover_groups = {}
+        self.event_log = EventLog('SPRouter')
+        self.flow_mods = FlowModBatcher()
+        self.barriers = BarrierGate(self.flow_mods)
+        self.link_ports = PortIndex()
+        self.port_stats = kwargs['port_stats']
+        self.fat_tree_topo = topo.Fattree(CONF.routing.fat_tree_k)
         self.ip_to_id, self.id_to_ip = self.create_mappings()
         self.shortest_paths_for_all_nodes = self.calculate_all_shortest_path_routs_for_servers()
-
-        self.adjacency = collections.defaultdict(lambda: collections.defaultdict(lambda: None))
+        self.switch_ports = topo.switch_ports(self.all_nodes)
+        self.arp = ArpResponder(self.datapaths, self.fat_tree_topo.servers, self.switch_ports, self.event_log)
+        self.workers = WorkerPool('routes')
+        # Roots whose trees have to be recomputed, and those of the recomputation running, if any
+        self.dirty_routes = set()
+        self.routes_in_flight = None
+        self.routes_retry = None
+        self.loop_metrics = LoopMetrics(self, [self.workers], self.flow_mods, self.event_log)
+        self.warm_restart = WarmRestart('SPRouter', self.flow_mods, self.event_log, self.learned_state)
+        if self.warm_restart.state is not None:
+            self.restore_state(self.warm_restart.state)
 
     def create_mappings(self):
         all_nodes = self.fat_tree_topo.servers + self.fat_tree_topo.edge_switches + self.fat_tree_topo.agg_switches + \
@@ -65,147 +94,486 @@ class SPRouter(app_manager.RyuApp):
         return ip_to_id, id_to_ip
 
     def calculate_all_shortest_path_routs_for_servers(self):
-        all_nodes = self.fat_tree_topo.servers + self.fat_tree_topo.core_switches + self.fat_tree_topo.agg_switches + \
-                    self.fat_tree_topo.edge_switches
-
-        all_paths = {}
-        for server in self.fat_tree_topo.servers:
-            all_paths[server.ip_address] = self.get_shortest_paths(server, all_nodes)
-
-        return all_paths
-
-    def get_shortest_paths(self, server, all_nodes):
-        distance = {}
-        previous = {}
-
-        for node in all_nodes:
-            distance[node.ip_address] = float('inf')
-            previous[node.ip_address] = None
-
-        distance[server.ip_address] = 0
-
-        visited_set = set(all_nodes)
-        while len(visited_set) > 0:
-            node_with_smallest_distance = self.minimum_distance(distance, visited_set)
-            visited_set.remove(node_with_smallest_distance)
-
-            for node in all_nodes:
-                if node_with_smallest_distance.is_neighbor(node):
-                    weight = 1
-                    if distance[node_with_smallest_distance.ip_address] + weight < \
-                            distance[node.ip_address]:
-                        distance[node.ip_address] = distance[node_with_smallest_distance.ip_address] + weight
-                        previous[node.ip_address] = node_with_smallest_distance.ip_address
-
-        return previous
-
-    def minimum_distance(self, distance, visited_set):
-        min = float('Inf')
-        selected = list(visited_set)[0]
-
-        for node in visited_set:
-            if distance[node.ip_address] < min:
-                min = distance[node.ip_address]
-                selected = node
-
-        return selected
-
-    # Topology discovery
+        self.all_nodes = self.fat_tree_topo.servers + self.fat_tree_topo.core_switches + \
+            self.fat_tree_topo.agg_switches + self.fat_tree_topo.edge_switches
+
+        bfs = topo.bfs_equal_cost_next_hops if CONF.routing.ecmp else topo.bfs_next_hops
+        self.trees = ShortestPathTrees(self.all_nodes, self.fat_tree_topo.servers, bfs)
+        self.node_index = self.trees.index
+        return self.trees.routes
+
+    # Indices of the next nodes from current towards dst_ip, more than one only with ecmp and none
+    # when the links that are up do not reach it
+    def next_hops(self, dst_ip, current):
+        server, attachment, table = self.shortest_paths_for_all_nodes[dst_ip]
+        if current == attachment:
+            return (server,)
+        return self.trees.next_hops(table, current)
+
+    # Servers on the same switch share their next hops and with that the select group, which is
+    # numbered after the node index of that switch
+    def ecmp_group_id(self, dst_ip):
+        return self.shortest_paths_for_all_nodes[dst_ip][1] + 1
+
+    # IPv4 match of the entries of a node towards dst_ip. With aggregate_flows, nodes other than the
+    # switch the server hangs off match the /24 of that switch, which all of its servers share.
+    def route_match(self, parser, node, dst_ip):
+        if CONF.routing.aggregate_flows and node != self.shortest_paths_for_all_nodes[dst_ip][1]:
+            network = int_to_ip(ip_to_int(dst_ip) & MASK_24)
+            return parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_dst=(network, int_to_ip(MASK_24)))
+        return parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_dst=dst_ip)
+
+    # Servers of a destination switch that need their own entry on the node, one stands in for all
+    # of them when their entries are aggregated
+    def route_destinations(self, node, root):
+        dst_ips = self.trees.servers[root]
+        if CONF.routing.aggregate_flows and node != root:
+            return dst_ips[:1]
+        return dst_ips
+
+    # Group the IPv4 entries of a switch towards dst_ip output to, None for a plain output action
+    def route_group(self, dpid, dst_ip):
+        group_id = self.ecmp_group_id(dst_ip)
+        if group_id in self.ecmp_groups.get(dpid, ()):
+            return group_id
+        if FAILOVER_GROUP_BASE + group_id in self.failover_groups.get(dpid, {}):
+            return FAILOVER_GROUP_BASE + group_id
+        return None
+
+    # State that warm_restart keeps over a restart: the MACs the reactive entries match on, the links
+    # that are down and the ARP table
+    def learned_state(self):
+        return {'server_macs': {dst_ip: sorted(macs) for dst_ip, macs in self.server_macs.items()},
+                'down_links': [[self.all_nodes[node_a].id, self.all_nodes[node_b].id]
+                               for node_a, node_b in sorted(self.trees.down)],
+                'ip_to_mac': dict(self.arp.ip_to_mac)}
+
+    # Links that came back up while the controller was down are reported by the discovery, the others
+    # stay down
+    def restore_state(self, state):
+        self.server_macs = {dst_ip: set(macs) for dst_ip, macs in state['server_macs'].items()}
+        for node_a, node_b in state['down_links']:
+            self.trees.link_down(self.node_index[node_a], self.node_index[node_b])
+        self.arp.ip_to_mac.update(state['ip_to_mac'])
+
+    def stop(self):
+        self.warm_restart.save()
+        super(SPRouter, self).stop()
+
+    # Topology discovery, kept up to date from the events instead of fetching all switches and
+    # links again whenever a switch enters
     @set_ev_cls(event.EventSwitchEnter)
     def get_topology_data(self, ev):
+        self.switches.add(ev.switch.dp.id)
+        topo.check_discovered_switches(self.fat_tree_topo, len(self.switches))
+        self.event_log.info('switch_enter', 'switch=%s switches=%d', ev.switch.dp.id, len(self.switches))
+
+    @set_ev_cls(event.EventSwitchLeave)
+    def switch_leave_handler(self, ev):
+        self.switches.discard(ev.switch.dp.id)
+        self.datapaths.pop(ev.switch.dp.id, None)
+        self.ecmp_groups.pop(ev.switch.dp.id, None)
+        self.failover_groups.pop(ev.switch.dp.id, None)
+        self.barriers.forget(ev.switch.dp.id)
+        self.flow_mods.forget(ev.switch.dp.id)
+        self.event_log.info('switch_leave', 'switch=%s switches=%d', ev.switch.dp.id, len(self.switches))
+
+    @set_ev_cls(event.EventLinkAdd)
+    def link_add_handler(self, ev):
+        self.link_ports.add_link(ev.link)
+        nodes = self.link_nodes(ev.link)
+        if nodes is not None:
+            self.recompute_routes(self.trees.link_up_roots(*nodes))
+
+    @set_ev_cls(event.EventLinkDelete)
+    def link_delete_handler(self, ev):
+        self.link_ports.delete_link(ev.link)
+        nodes = self.link_nodes(ev.link)
+        if nodes is not None:
+            self.recompute_routes(self.trees.link_down_roots(*nodes))
+
+    # Node indices of the two ends of a discovered link, None for switches outside the fat-tree
+    def link_nodes(self, link):
+        node_a = self.node_index.get('sw' + str(link.src.dpid))
+        node_b = self.node_index.get('sw' + str(link.dst.dpid))
+        if node_a is None or node_b is None:
+            return None
+        return node_a, node_b
+
+    # Recompute the trees of the roots on a worker, one recomputation at a time. Events that come in
+    # while one runs collect their roots for the next, together with the roots of the running one:
+    # it works on the links from before the event, and the roots were chosen on its old tables.
+    def recompute_routes(self, roots):
+        self.dirty_routes.update(roots)
+        if self.routes_in_flight is not None:
+            self.dirty_routes.update(self.routes_in_flight)
+        else:
+            self.submit_routes()
 
-        # Switches and links in the network
-
-        switch_list = copy.copy(get_switch(self, None))
-
-        self.switches = [switch.dp.id for switch in switch_list]
-        self.datapath_list = [switch.dp for switch in switch_list]
-        print(f"{len(self.switches)} switches={self.switches}")
-
-        self.switches_links = copy.copy(get_link(self, None))
-        print(f'{len(self.switches_links)} links')
+    def submit_routes(self):
+        if not self.dirty_routes:
+            return
+        self.routes_in_flight = sorted(self.dirty_routes)
+        self.dirty_routes = set()
+        tables = {root: self.trees.tables[root] for root in self.routes_in_flight}
+        self.workers.submit(self.trees.compute_tables, (self.trees.adjacency_snapshot(), tables), self.apply_routes,
+                            self.routes_failed)
+
+    def apply_routes(self, results):
+        self.routes_in_flight = None
+        self.update_routes(self.trees.apply_tables(results))
+        self.flow_mods.flush()
+        self.submit_routes()
+
+    # A failed recomputation gives its roots back. They are submitted again with the next link event
+    # or after ROUTES_RETRY_DELAY seconds, not right away, where the same failure would come back.
+    def routes_failed(self, error):
+        self.dirty_routes.update(self.routes_in_flight)
+        self.routes_in_flight = None
+        self.event_log.warning('routes_failed', 'roots=%d retry_in=%ds', len(self.dirty_routes), ROUTES_RETRY_DELAY)
+        if self.routes_retry is None:
+            self.routes_retry = hub.spawn_after(ROUTES_RETRY_DELAY, self.retry_routes)
+
+    def retry_routes(self):
+        self.routes_retry = None
+        if self.routes_in_flight is None:
+            self.submit_routes()
+
+    # Bring the switches whose next hops changed in line with the recomputed trees. Proactive entries
+    # and ECMP groups are rewritten, reactive entries towards the servers of the tree are deleted so
+    # that their next packet is routed again. Aggregated entries are deleted by their ipv4_dst,
+    # the others by the eth_dst of the servers.
+    def update_routes(self, changes):
+        for root, nodes in changes.items():
+            dst_ips = self.trees.servers[root]
+            updated = 0
+
+            # The backups of switches whose next hops stayed the same can change as well
+            if CONF.routing.fast_failover:
+                for datapath in list(self.datapaths.values()):
+                    if self.install_failover_group(datapath, dst_ips[0]) and CONF.routing.proactive:
+                        for dst_ip in self.route_destinations(self.node_index['sw' + str(datapath.id)], root):
+                            self.install_route(datapath, dst_ip)
+            for node in nodes:
+                datapath = self.datapaths.get(topo.node_dpid(self.all_nodes[node].id)) \
+                    if self.all_nodes[node].type != 'Server' else None
+                if datapath is None:
+                    continue
+                if CONF.routing.ecmp:
+                    self.install_ecmp_group(datapath, dst_ips[0])
+                parser = datapath.ofproto_parser
+                if CONF.routing.proactive:
+                    for dst_ip in self.route_destinations(node, root):
+                        self.install_route(datapath, dst_ip)
+                elif CONF.routing.aggregate_flows:
+                    for dst_ip in self.route_destinations(node, root):
+                        self.delete_flows(datapath, self.route_match(parser, node, dst_ip))
+                for mac in {mac for dst_ip in dst_ips for mac in self.server_macs.get(dst_ip, ())}:
+                    self.delete_flows(datapath, parser.OFPMatch(eth_dst=mac))
+                updated += 1
+            self.event_log.info('routes_changed', 'root=%s updated_switches=%d', self.all_nodes[root].id, updated)
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
+        self.warm_restart.switch_connected(datapath)
 
         # Install entry-miss flow entry
         match = parser.OFPMatch()
         actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
                                           ofproto.OFPCML_NO_BUFFER)]
         self.add_flow(datapath, 0, match, actions)
+        self.datapaths[datapath.id] = datapath
+
+        if CONF.routing.ecmp:
+            self.install_ecmp_groups(datapath)
+
+        if CONF.routing.fast_failover:
+            self.install_failover_groups(datapath)
+
+        if CONF.routing.proactive:
+            self.install_proactive_flows(datapath)
+        self.flow_mods.flush()
+
+    # Install a select group for every destination switch reached over more than one equal-cost
+    # next hop, with one bucket per next hop. The switch picks the bucket by hashing the flow.
+    def install_ecmp_groups(self, datapath):
+        self.ecmp_groups[datapath.id] = set()
+        for dst_ips in self.trees.servers.values():
+            self.install_ecmp_group(datapath, dst_ips[0])
+
+        self.event_log.info('ecmp_groups_installed', 'switch=%s groups=%d', datapath.id,
+                            len(self.ecmp_groups[datapath.id]))
+
+    # Once a switch has the group of a destination, its entries keep pointing at it and the group is
+    # modified to the current next hops, however many there are
+    def install_ecmp_group(self, datapath, dst_ip):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        switch_id = 'sw' + str(datapath.id)
+        group_id = self.ecmp_group_id(dst_ip)
+        groups = self.ecmp_groups.setdefault(datapath.id, set())
+
+        next_hops = self.next_hops(dst_ip, self.node_index[switch_id])
+        if group_id in groups:
+            command = ofproto.OFPGC_MODIFY
+        elif len(next_hops) > 1:
+            command = ofproto.OFPGC_ADD
+            groups.add(group_id)
+        else:
+            return
+
+        # With fast_failover the switch only hashes over the buckets whose port is up
+        buckets = []
+        for hop in next_hops:
+            port = self.switch_ports[(switch_id, self.all_nodes[hop].id)]
+            watch_port = port if CONF.routing.fast_failover else ofproto.OFPP_ANY
+            buckets.append(parser.OFPBucket(weight=1, watch_port=watch_port, watch_group=ofproto.OFPG_ANY,
+                                            actions=[parser.OFPActionOutput(port)]))
+        self.flow_mods.send(datapath,
+                            parser.OFPGroupMod(datapath, command, ofproto.OFPGT_SELECT, group_id, buckets))
+
+    def install_failover_groups(self, datapath):
+        for dst_ips in self.trees.servers.values():
+            self.install_failover_group(datapath, dst_ips[0])
+
+        self.event_log.info('failover_groups_installed', 'switch=%s groups=%d', datapath.id,
+                            len(self.failover_groups.get(datapath.id, {})))
+
+    # Fast-failover group of a switch towards the switch of dst_ip, with the first next hop as long as
+    # its port is up and the loop-free alternate after it. Switches without an alternate, and those
+    # that already spread the traffic with an ECMP group, get none. Returns whether a group was added.
+    def install_failover_group(self, datapath, dst_ip):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        switch_id = 'sw' + str(datapath.id)
+        current = self.node_index[switch_id]
+        server, root, table = self.shortest_paths_for_all_nodes[dst_ip]
+        group_id = FAILOVER_GROUP_BASE + self.ecmp_group_id(dst_ip)
+        groups = self.failover_groups.setdefault(datapath.id, {})
+
+        if current == root or self.ecmp_group_id(dst_ip) in self.ecmp_groups.get(datapath.id, ()):
+            return False
+        next_hops = self.next_hops(dst_ip, current)
+        backup = self.trees.backup_next_hop(table, root, current)
+        hops = next_hops[:1] + ((backup,) if backup is not None and next_hops else ())
+
+        if groups.get(group_id) == hops:
+            return False
+        added = group_id not in groups
+        if added and len(hops) < 2:
+            return False
+        groups[group_id] = hops
+
+        buckets = []
+        for hop in hops:
+            port = self.switch_ports[(switch_id, self.all_nodes[hop].id)]
+            buckets.append(parser.OFPBucket(watch_port=port, watch_group=ofproto.OFPG_ANY,
+                                            actions=[parser.OFPActionOutput(port)]))
+        command = ofproto.OFPGC_ADD if added else ofproto.OFPGC_MODIFY
+        self.flow_mods.send(datapath, parser.OFPGroupMod(datapath, command, ofproto.OFPGT_FF, group_id, buckets))
+        return added
+
+    # Install an IPv4 entry towards every server, following the precomputed shortest paths
+    def install_proactive_flows(self, datapath):
+        current = self.node_index['sw' + str(datapath.id)]
+        num_flows = 0
+        for root in self.trees.servers:
+            for dst_ip in self.route_destinations(current, root):
+                self.install_route(datapath, dst_ip)
+                num_flows += 1
+
+        self.event_log.info('proactive_flows_installed', 'switch=%s flows=%d', datapath.id, num_flows)
+
+    # Proactive entry of a switch towards a server, deleted while the server cannot be reached
+    def install_route(self, datapath, dst_ip):
+        parser = datapath.ofproto_parser
+        switch_id = 'sw' + str(datapath.id)
+        next_hops = self.next_hops(dst_ip, self.node_index[switch_id])
+        match = self.route_match(parser, self.node_index[switch_id], dst_ip)
+
+        group_id = self.route_group(datapath.id, dst_ip)
+        if group_id is not None:
+            actions = [parser.OFPActionGroup(group_id)]
+        elif next_hops:
+            actions = [parser.OFPActionOutput(self.switch_ports[(switch_id, self.all_nodes[next_hops[0]].id)])]
+        else:
+            self.delete_flows(datapath, match)
+            return
+        self.add_flow(datapath, 1, match, actions)
+
+    # Actions of a switch for IPv4 traffic towards dst_ip and the next nodes they can send it to,
+    # None when the server cannot be reached
+    def route_actions(self, parser, node, dst_ip):
+        switch_id = self.all_nodes[node].id
+        dpid = topo.node_dpid(switch_id)
+        server, root, table = self.shortest_paths_for_all_nodes[dst_ip]
+        if node == root:
+            return [parser.OFPActionOutput(self.switch_ports[(switch_id, self.all_nodes[server].id)])], []
+
+        next_hops = self.next_hops(dst_ip, node)
+        group_id = self.route_group(dpid, dst_ip)
+        if group_id in self.ecmp_groups.get(dpid, ()):
+            return [parser.OFPActionGroup(group_id)], list(next_hops)
+        if group_id is not None:
+            return [parser.OFPActionGroup(group_id)], list(next_hops[:1])
+        if next_hops:
+            return [parser.OFPActionOutput(self.switch_ports[(switch_id, self.all_nodes[next_hops[0]].id)])], \
+                list(next_hops[:1])
+        return None
+
+    # Install the (in_port, eth_dst) entries, or the route_match entries with aggregate_flows, of
+    # every switch the packet can cross on its way to dst_ip, from the server back to this switch,
+    # and send the packet out once the switches behind this one have confirmed theirs with a
+    # barrier, so that none of them sends it to the controller
+    def install_path(self, datapath, in_port, dst_ip, dst, data):
+        parser = datapath.ofproto_parser
+        current = self.node_index['sw' + str(datapath.id)]
+        if not CONF.routing.aggregate_flows:
+            self.server_macs.setdefault(dst_ip, set()).add(dst)
+
+        # Breadth-first over the next hops, each switch with the ports the packet can come in on
+        hops = [(current, in_port)]
+        seen = set(hops)
+        entries = []
+        for node, node_in_port in hops:
+            route = self.route_actions(parser, node, dst_ip)
+            if route is None:
+                self.event_log.warning('no_route', 'switch=%s dst_ip=%s dropping packet', self.all_nodes[node].id,
+                                       dst_ip)
+                return
+            actions, next_nodes = route
+            entries.append((node, node_in_port, actions))
+            for next_node in next_nodes:
+                hop = (next_node, self.switch_ports[(self.all_nodes[next_node].id, self.all_nodes[node].id)])
+                if hop not in seen:
+                    seen.add(hop)
+                    hops.append(hop)
+
+        downstream = []
+        for node, node_in_port, actions in reversed(entries):
+            node_datapath = self.datapaths.get(topo.node_dpid(self.all_nodes[node].id))
+            if node_datapath is None:
+                continue
+            node_parser = node_datapath.ofproto_parser
+            if CONF.routing.aggregate_flows:
+                match = self.route_match(node_parser, node, dst_ip)
+            else:
+                match = node_parser.OFPMatch(in_port=node_in_port, eth_dst=dst)
+            self.add_flow(node_datapath, 1, match, actions, CONF.routing.flow_idle_timeout,
+                          CONF.routing.flow_hard_timeout)
+            if node_datapath is not datapath and node_datapath not in downstream:
+                downstream.append(node_datapath)
+        self.event_log.debug('path_installed', 'switch=%s dst_ip=%s switches=%d', datapath.id, dst_ip, len(entries))
+
+        out = parser.OFPPacketOut(datapath=datapath, in_port=in_port, actions=entries[0][2],
+                                  buffer_id=datapath.ofproto.OFP_NO_BUFFER, data=data)
+        self.barriers.send_after_barriers(downstream, out)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, ev):
+        self.barriers.barrier_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, ev):
+        self.warm_restart.flow_stats_reply(ev.msg)
+        self.flow_mods.flush()
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        self.warm_restart.flow_removed(ev.msg)
 
     # Add a flow entry to the flow-table
-    def add_flow(self, datapath, priority, match, actions):
+    def add_flow(self, datapath, priority, match, actions, idle_timeout=0, hard_timeout=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         # Construct flow_mod message and send it
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
-        mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                match=match, instructions=inst)
-        datapath.send_msg(mod)
+        mod = parser.OFPFlowMod(datapath=datapath, priority=priority, match=match, instructions=inst,
+                                idle_timeout=idle_timeout, hard_timeout=hard_timeout)
+        self.flow_mods.send(datapath, mod)
+
+    # Delete the flow entries covered by the match
+    def delete_flows(self, datapath, match):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE, out_port=ofproto.OFPP_ANY,
+                                out_group=ofproto.OFPG_ANY, match=match)
+        self.flow_mods.send(datapath, mod)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
+        start = time.perf_counter()
+        self.handle_packet_in(ev)
+        self.flow_mods.flush()
+        self.loop_metrics.packet_in(start)
+
+    def handle_packet_in(self, ev):
         msg = ev.msg
         datapath = msg.datapath
-        ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
+        pkt = packet_parser.parse(msg.data)
+        if pkt is None:
+            return
 
-        dst = eth.dst
-        src = eth.src
+        dst = pkt.eth_dst
+        src = pkt.eth_src
         dpid = datapath.id
-        self.mac_to_port.setdefault(dpid, {})
-        switch_ip = self.id_to_ip['sw'+str(dpid)]
-
-        if eth.ethertype == ether_types.ETH_TYPE_ARP:
-            self.mac_to_port[dpid][src] = in_port
-            arp_pkt = pkt.get_protocol(arp.arp)
-            dst_ip = arp_pkt.dst_ip
-            type_of_eth = 'ARP'
-        elif eth.ethertype == ether_types.ETH_TYPE_IP:
-            ip_pkt = pkt.get_protocol(ipv4.ipv4)
-            dst_ip = ip_pkt.dst
-            type_of_eth = 'IP'
-        else:
+        dst_ip = pkt.dst_ip
+
+        if pkt.ethertype == ether_types.ETH_TYPE_ARP:
+            self.event_log.debug('packet_in_arp', 'switch=%s in_port=%s src=%s dst=%s dst_ip=%s', dpid, in_port, src,
+                                 dst, dst_ip)
+            self.arp.handle(datapath, in_port, pkt, msg.data)
             return
+        elif pkt.ethertype != ether_types.ETH_TYPE_IP:
+            return
+
+        self.event_log.debug('packet_in_ip', 'switch=%s in_port=%s src=%s dst=%s dst_ip=%s', dpid, in_port, src, dst,
+                             dst_ip)
 
-        print(f'[{dpid}][{in_port}][{type_of_eth}]{src}][{dst}][Destination Ip: {dst_ip}]')
+        if CONF.routing.path_install:
+            self.install_path(datapath, in_port, dst_ip, dst, msg.data)
+            return
 
-        next_ip = self.shortest_paths_for_all_nodes[dst_ip][switch_ip]
-        next_dpid = self.ip_to_id[next_ip]
+        next_hops = self.next_hops(dst_ip, self.node_index['sw' + str(dpid)])
+        if not next_hops:
+            self.event_log.warning('no_route', 'switch=%s dst_ip=%s dropping packet', dpid, dst_ip)
+            return
+        next_node = self.all_nodes[next_hops[0]]
+        next_ip = next_node.ip_address
+        next_dpid = next_node.id
 
         if next_ip == dst_ip:
-            if dst in self.mac_to_port[dpid]:
-                out_port = self.mac_to_port[dpid][dst]
-            else:
-                out_port = ofproto.OFPP_FLOOD
+            out_port = self.switch_ports[(f'sw{dpid}', next_dpid)]
         else:
-            for link in self.switches_links:
-                if link.src.dpid == dpid and 'sw' + str(link.dst.dpid) == next_dpid:
-                    out_port = link.src.port_no
-                    break
-                elif link.dst.dpid == dpid and 'sw'+str(link.src.dpid) == next_dpid:
-                    out_port = link.dst.port_no
-                    break
+            out_port = self.link_ports.port(dpid, topo.node_dpid(next_dpid))
+            if out_port is None:
+                self.event_log.warning('no_link', 'switch=%s next_hop=%s dropping packet', dpid, next_dpid)
+                return
 
         actions = [parser.OFPActionOutput(out_port)]
+        group_id = self.route_group(dpid, dst_ip)
+        if group_id is not None and next_ip != dst_ip:
+            actions = [parser.OFPActionGroup(group_id)]
 
-        if out_port != ofproto.OFPP_FLOOD and eth.ethertype == ether_types.ETH_TYPE_IP:
+        if CONF.routing.aggregate_flows:
+            match = self.route_match(parser, self.node_index['sw' + str(dpid)], dst_ip)
+        else:
+            self.server_macs.setdefault(dst_ip, set()).add(dst)
             match = parser.OFPMatch(in_port=in_port, eth_dst=dst)
-            print(f'Adding flow: switch: {dpid} in_port: {in_port}, out_port: {out_port}, src: {src}, dst: {dst}')
-            self.add_flow(datapath, 1, match, actions)
+        self.event_log.debug('flow_added', 'switch=%s in_port=%s out_port=%s src=%s dst=%s', dpid, in_port, out_port,
+                             src, dst)
+        self.add_flow(datapath, 1, match, actions, CONF.routing.flow_idle_timeout, CONF.routing.flow_hard_timeout)
 
         out = parser.OFPPacketOut(datapath=datapath, in_port=in_port, actions=actions,
                                   buffer_id=datapath.ofproto.OFP_NO_BUFFER, data=msg.data)
 
-        datapath.send_msg(out)
+        self.flow_mods.send(datapath, out)
 
@@ -0,0 +1,110 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Failing worker jobs, run from this directory with python -m unittest test_workers
+
+# !/usr/bin/env python3
+import collections
+import time
+import unittest
+
+from ryu.lib import hub
+
+from routing_config import CONF
+CONF.set_override('log_level', 'ERROR', group='routing')
+
+import topo
+from port_stats import PortStatsMonitor
+from sp_routing import SPRouter
+from workers import WorkerPool
+
+LinkEnd = collections.namedtuple('LinkEnd', 'dpid port_no')
+Link = collections.namedtuple('Link', 'src dst')
+
+
+def fail(*args):
+    raise RuntimeError('job failed')
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def check_failure(self, pool):
+        results, errors = [], []
+        pool.submit(fail, (), results.append, errors.append)
+        pool.submit(sum, ([1, 2],), results.append, errors.append)
+        deadline = time.monotonic() + 5
+        while len(results) + len(errors) < 2 and time.monotonic() < deadline:
+            hub.sleep(0.01)
+        self.assertEqual(results, [3])
+        self.assertEqual([str(error) for error in errors], ['job failed'])
+        self.assertEqual(pool.pending, 0)
+
+    def test_inline_failure_calls_errback(self):
+        self.check_failure(WorkerPool('test', num_threads=0))
+
+    def test_worker_failure_calls_errback(self):
+        self.check_failure(WorkerPool('test', num_threads=1, max_pending=4))
+
+
+class RouteRecomputationTest(unittest.TestCase):
+    def setUp(self):
+        CONF.set_override('worker_threads', 0, group='routing')
+        self.app = SPRouter(port_stats=PortStatsMonitor())
+        edge = self.app.fat_tree_topo.edge_switches[0]
+        agg = topo.uplink_neighbours(edge)[0]
+        self.edge, self.agg = self.app.node_index[edge.id], self.app.node_index[agg.id]
+        self.link = Link(LinkEnd(topo.node_dpid(edge.id), self.app.switch_ports[(edge.id, agg.id)]),
+                         LinkEnd(topo.node_dpid(agg.id), self.app.switch_ports[(agg.id, edge.id)]))
+
+    def tearDown(self):
+        CONF.clear_override('worker_threads', group='routing')
+        if self.app.routes_retry is not None:
+            hub.kill(self.app.routes_retry)
+
+    def uses_link(self):
+        return any(self.agg in self.app.trees.next_hops(table, self.edge) for table in self.app.trees.tables.values())
+
+    def test_failed_recomputation_is_retried(self):
+        compute_tables = self.app.trees.compute_tables
+        self.app.trees.compute_tables = fail
+        self.app.link_delete_handler(collections.namedtuple('Event', 'link')(self.link))
+        self.assertIsNone(self.app.routes_in_flight)
+        self.assertTrue(self.app.dirty_routes)
+        self.assertIsNotNone(self.app.routes_retry)
+        self.assertTrue(self.uses_link())
+
+        self.app.trees.compute_tables = compute_tables
+        retry = self.app.routes_retry
+        self.app.retry_routes()
+        hub.kill(retry)
+        self.assertIsNone(self.app.routes_in_flight)
+        self.assertFalse(self.app.dirty_routes)
+        self.assertFalse(self.uses_link())
+
+    def test_next_link_event_submits_after_failure(self):
+        compute_tables = self.app.trees.compute_tables
+        self.app.trees.compute_tables = fail
+        self.app.link_delete_handler(collections.namedtuple('Event', 'link')(self.link))
+
+        self.app.trees.compute_tables = compute_tables
+        self.app.link_add_handler(collections.namedtuple('Event', 'link')(self.link))
+        self.assertIsNone(self.app.routes_in_flight)
+        self.assertFalse(self.app.dirty_routes)
+        self.assertTrue(self.uses_link())
+
+
+if __name__ == '__main__':
+    unittest.main()
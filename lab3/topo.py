@@ -1,3 +1,7 @@
+import sys
+from array import array
+
+
 class NetworkError(Exception):
     def __init__(self, message):
         super(NetworkError, self).__init__(message)
@@ -54,13 +58,150 @@ class Node:
         return f'{self.id} {self.ip_address}'
 
 
+# Integer adjacency of the topology, nodes are numbered in the order they are given
+def build_adjacency(nodes):
+    index = {node.id: i for i, node in enumerate(nodes)}
+    adjacency = [[] for _ in nodes]
+    for node in nodes:
+        for edge in node.edges:
+            neighbour = edge.right_node if edge.left_node is node else edge.left_node
+            adjacency[index[node.id]].append(index[neighbour.id])
+    return index, adjacency
+
+
+# Next hop of every node towards the destination, from a single BFS rooted at the destination.
+# -1 marks the destination itself and unreachable nodes.
+def bfs_next_hops(adjacency, destination):
+    next_hops = array('i', [-1]) * len(adjacency)
+    visited = bytearray(len(adjacency))
+    visited[destination] = 1
+    frontier = [destination]
+    while frontier:
+        next_frontier = []
+        for node in frontier:
+            for neighbour in adjacency[node]:
+                if not visited[neighbour]:
+                    visited[neighbour] = 1
+                    next_hops[neighbour] = node
+                    next_frontier.append(neighbour)
+        frontier = next_frontier
+    return next_hops
+
+
+# All equal-cost next hops of every node towards the destination, i.e. the neighbours one hop closer
+# to it, from a single BFS rooted at the destination. The destination and unreachable nodes get ().
+def bfs_equal_cost_next_hops(adjacency, destination):
+    distances = array('i', [-1]) * len(adjacency)
+    distances[destination] = 0
+    next_hops = [()] * len(adjacency)
+    frontier = [destination]
+    while frontier:
+        next_frontier = []
+        for node in frontier:
+            for neighbour in adjacency[node]:
+                if distances[neighbour] == -1:
+                    distances[neighbour] = distances[node] + 1
+                    next_hops[neighbour] = (node,)
+                    next_frontier.append(neighbour)
+                elif distances[neighbour] == distances[node] + 1:
+                    next_hops[neighbour] += (node,)
+        frontier = next_frontier
+    return next_hops
+
+
+# Shortest-path next hops towards every server. A server hangs off a single switch, so one BFS per
+# attachment switch covers all of its servers and the servers share that switch's table.
+# Returns the node index and server ip -> (server index, attachment switch index, next hop table).
+# bfs builds the tables, bfs_equal_cost_next_hops keeps all equal-cost next hops.
+def server_next_hops(nodes, servers, bfs=bfs_next_hops):
+    index, adjacency = build_adjacency(nodes)
+    tables = {}
+    routes = {}
+    for server in servers:
+        attachment = adjacency[index[server.id]][0]
+        if attachment not in tables:
+            tables[attachment] = bfs(adjacency, attachment)
+        routes[server.ip_address] = (index[server.id], attachment, tables[attachment])
+    return index, routes
+
+
+# Index of the next node from current towards the server of a route built by server_next_hops
+def next_hop_to_server(route, current):
+    server, attachment, next_hops = route
+    if current == attachment:
+        return server
+    return next_hops[current]
+
+
+# Indices of all equal-cost next nodes from current towards the server of a route built by
+# server_next_hops with bfs_equal_cost_next_hops
+def next_hops_to_server(route, current):
+    server, attachment, next_hops = route
+    if current == attachment:
+        return (server,)
+    return next_hops[current]
+
+
+# Every edge attached to the given nodes, each only once
+def unique_edges(nodes):
+    seen = set()
+    edges = []
+    for node in nodes:
+        for edge in node.edges:
+            if id(edge) not in seen:
+                seen.add(id(edge))
+                edges.append(edge)
+    return edges
+
+
+# (switch id, neighbour id) -> switch port. Ports are numbered from 1 in the order the links of the
+# switch were created; fat-tree.py wires Mininet with the same numbering so the controllers know
+# every port before link discovery has run.
+def switch_ports(nodes):
+    ports = {}
+    for node in nodes:
+        if not node.type.startswith('Switch'):
+            continue
+        for port, edge in enumerate(node.edges, start=1):
+            neighbour = edge.right_node if edge.left_node is node else edge.left_node
+            ports[(node.id, neighbour.id)] = port
+    return ports
+
+
+# Neighbours of a switch one layer closer to the core
+def uplink_neighbours(node):
+    uplink_type = 'Switch Level ' + str(int(node.type[-1]) - 1)
+    neighbours = [edge.right_node if edge.left_node is node else edge.left_node for edge in node.edges]
+    return [neighbour for neighbour in neighbours if neighbour.type == uplink_type]
+
+
+# Mininet derives the datapath id from the digits in the switch name
+def node_dpid(node_id):
+    return int(node_id[2:])
+
+
+# MAC address fat-tree.py gives a server, the four bytes of its IP address behind 00:00, so that the
+# controllers know it before the server has sent anything
+def server_mac(ip_address):
+    return '00:00:' + ':'.join(f'{int(byte):02x}' for byte in ip_address.split('.'))
+
+
+# Warn when more switches connect than the configured fat-tree has, the routers are then
+# running with the wrong k
+def check_discovered_switches(fat_tree, num_discovered):
+    num_expected = fat_tree.num_core + fat_tree.num_agg + fat_tree.num_edge
+    if num_discovered > num_expected:
+        print(f'WARNING: {num_discovered} switches discovered but a fat-tree with k={fat_tree.num_ports} has '
+              f'{num_expected}, set fat_tree_k in the [routing] config section')
+
+
 class Fattree:
-    core_switches = []
-    agg_switches = []
-    edge_switches = []
-    servers = []
 
     def __init__(self, num_ports):
+        self.core_switches = []
+        self.agg_switches = []
+        self.edge_switches = []
+        self.servers = []
         self.num_ports = num_ports
         self.num_pods = num_ports
         self.num_core = (num_ports // 2) ** 2
@@ -105,8 +246,8 @@ class Fattree:
         return f'10.{pod_index}.{edge_switch_index}.1'
 
     def _server_ip_addressing_scheme(self, sv_index):
-        pod_index = int(((sv_index - (sv_index % self.num_pods)) + self.num_pods) / self.num_pods) - 1
         half_ports = self.num_ports / 2
+        pod_index = int(sv_index // (half_ports ** 2))
         switch_index = edge_switch_index = int(sv_index/half_ports % half_ports)
         id = 2 + int(sv_index % (self.num_ports / 2))
         return f'10.{pod_index}.{switch_index}.{id}'
@@ -159,5 +300,5 @@ class Fattree:
 
 
 if __name__ == '__main__':
-    topology = Fattree(4)
+    topology = Fattree(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
 
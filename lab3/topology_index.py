@@ -0,0 +1,165 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import topo
+
+
+# Local port of every switch towards each of its neighbour switches, built from the links
+# reported by ryu.topology and kept up to date with the link add/delete events
+class PortIndex:
+    def __init__(self):
+        self.ports = {}
+
+    def rebuild(self, links):
+        self.ports.clear()
+        for link in links:
+            self.add_link(link)
+
+    def add_link(self, link):
+        self.ports[(link.src.dpid, link.dst.dpid)] = link.src.port_no
+        self.ports[(link.dst.dpid, link.src.dpid)] = link.dst.port_no
+
+    def delete_link(self, link):
+        self.ports.pop((link.src.dpid, link.dst.dpid), None)
+        self.ports.pop((link.dst.dpid, link.src.dpid), None)
+
+    # Port of dpid that leads to neighbour_dpid, None while the link is not known
+    def port(self, dpid, neighbour_dpid):
+        return self.ports.get((dpid, neighbour_dpid))
+
+    def __len__(self):
+        return len(self.ports)
+
+
+# Shortest-path trees towards every server attachment switch over the links that are up. A link
+# going down only recomputes the trees that use it, a link coming back only the trees it gives a
+# shorter (with multipath an equally short) way to their root. Both return, per recomputed root,
+# the node indices whose next hops changed, so that only their flow entries have to be updated.
+# The *_roots methods, compute_tables and apply_tables split a recomputation so that the BFS can run
+# on a worker thread over an adjacency_snapshot.
+class ShortestPathTrees:
+    def __init__(self, nodes, servers, bfs=topo.bfs_next_hops):
+        self.bfs = bfs
+        self.index, self.adjacency = topo.build_adjacency(nodes)
+        _, self.routes = topo.server_next_hops(nodes, servers, bfs)
+        self.tables = {attachment: table for _, attachment, table in self.routes.values()}
+        self.servers = {}
+        for ip_address, (_, attachment, _) in self.routes.items():
+            self.servers.setdefault(attachment, []).append(ip_address)
+        self.down = set()
+
+    # Next hops of a node as a tuple, for the tables of both bfs_next_hops and bfs_equal_cost_next_hops
+    def next_hops(self, table, node):
+        hops = table[node]
+        if isinstance(hops, tuple):
+            return hops
+        return (hops,) if hops >= 0 else ()
+
+    # Hops from node to the root of the tree, None when it cannot reach it
+    def distance(self, table, node, root):
+        hops = 0
+        while node != root:
+            next_hops = self.next_hops(table, node)
+            if not next_hops:
+                return None
+            node = next_hops[0]
+            hops += 1
+        return hops
+
+    # Loop-free alternate of node towards the root: the neighbour closest to the root, other than the
+    # next hops, whose own shortest path does not lead back through node. None if there is none.
+    def backup_next_hop(self, table, root, node):
+        distance = self.distance(table, node, root)
+        if distance is None:
+            return None
+        next_hops = self.next_hops(table, node)
+        backup = None
+        for neighbour in self.adjacency[node]:
+            if neighbour in next_hops:
+                continue
+            via = self.distance(table, neighbour, root)
+            if via is not None and via <= distance and (backup is None or via < backup[0]):
+                backup = (via, neighbour)
+        return backup[1] if backup else None
+
+    def link_down(self, node_a, node_b):
+        return self._recompute(self.link_down_roots(node_a, node_b))
+
+    def link_up(self, node_a, node_b):
+        return self._recompute(self.link_up_roots(node_a, node_b))
+
+    # Take a link out of the adjacency and return the roots whose trees used it
+    def link_down_roots(self, node_a, node_b):
+        link = (min(node_a, node_b), max(node_a, node_b))
+        if link in self.down:
+            return []
+        self.down.add(link)
+        self.adjacency[node_a].remove(node_b)
+        self.adjacency[node_b].remove(node_a)
+        return [root for root, table in self.tables.items()
+                if node_b in self.next_hops(table, node_a) or node_a in self.next_hops(table, node_b)]
+
+    # Put a link back into the adjacency and return the roots whose trees it shortens
+    def link_up_roots(self, node_a, node_b):
+        link = (min(node_a, node_b), max(node_a, node_b))
+        if link not in self.down:
+            return []
+        self.down.remove(link)
+        self.adjacency[node_a].append(node_b)
+        self.adjacency[node_b].append(node_a)
+        return [root for root, table in self.tables.items()
+                if self._shortens(table, root, node_a, node_b) or self._shortens(table, root, node_b, node_a)]
+
+    # Whether node gets a shorter path to the root through neighbour
+    def _shortens(self, table, root, node, neighbour):
+        via = self.distance(table, neighbour, root)
+        if via is None:
+            return False
+        current = self.distance(table, node, root)
+        if current is None:
+            return True
+        if self.bfs is topo.bfs_equal_cost_next_hops:
+            return via + 1 <= current
+        return via + 1 < current
+
+    # Copy of the adjacency for compute_tables to work on outside the event loop
+    def adjacency_snapshot(self):
+        return [list(neighbours) for neighbours in self.adjacency]
+
+    # New table of every root in tables, which maps the roots to their current table, and the nodes
+    # whose next hops it changes. Tables are replaced and never changed, so this only reads.
+    def compute_tables(self, adjacency, tables):
+        results = {}
+        for root, old_table in tables.items():
+            new_table = self.bfs(adjacency, root)
+            results[root] = (new_table, [node for node in range(len(adjacency))
+                                         if self.next_hops(old_table, node) != self.next_hops(new_table, node)])
+        return results
+
+    # Replace the tables of the roots and return {root: [nodes whose next hops changed]}
+    def apply_tables(self, results):
+        changes = {}
+        for root, (new_table, changed) in results.items():
+            changes[root] = changed
+            self.tables[root] = new_table
+            for ip_address in self.servers[root]:
+                server, attachment, _ = self.routes[ip_address]
+                self.routes[ip_address] = (server, attachment, new_table)
+        return changes
+
+    def _recompute(self, roots):
+        return self.apply_tables(self.compute_tables(self.adjacency, {root: self.tables[root] for root in roots}))
@@ -0,0 +1,126 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import socket
+import struct
+
+
+def ip_to_int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def int_to_ip(address):
+    return socket.inet_ntoa(struct.pack('!I', address))
+
+
+def ip_from_octets(a, b, c, d):
+    return (a << 24) | (b << 16) | (c << 8) | d
+
+
+MASK_16 = 0xffff0000
+MASK_24 = 0xffffff00
+MASK_32 = 0xffffffff
+
+
+def prefix_length(mask):
+    return bin(mask).count('1')
+
+
+# Two-level routing table of every switch compiled for lookups on integer addresses.
+# The prefixes of a switch are bucketed by prefix length, each bucket being a dict keyed by the
+# masked address, and are searched longest prefix first. The suffixes are a dict keyed by the
+# host byte. Routes are (next hop id, next hop ip, priority).
+class TwoLevelTable:
+    def __init__(self):
+        self.prefixes = {}
+        self.suffixes = {}
+
+    # Add the routes of one prefix length, keyed by masked address. Buckets are never modified
+    # afterwards, so switches with the same routes can share them.
+    def add_bucket(self, switch, mask, routes):
+        buckets = self.prefixes.setdefault(switch, [])
+        buckets.append((mask, routes))
+        buckets.sort(key=lambda bucket: -prefix_length(bucket[0]))
+
+    def lookup(self, switch, destination):
+        return self.lookup_entry(switch, destination)[2]
+
+    # Entry the destination hits as (mask, masked address, route), the mask is None for suffixes
+    def lookup_entry(self, switch, destination):
+        for mask, routes in self.prefixes.get(switch, ()):
+            route = routes.get(destination & mask)
+            if route is not None:
+                return mask, destination & mask, route
+
+        route = self.suffixes.get(switch, {}).get(destination & 0xff)
+        if route is not None:
+            return None, destination & 0xff, route
+
+        raise KeyError(f"No route could be identified for ip: {int_to_ip(destination)}, switch: {switch}")
+
+    def dump(self):
+        lines = []
+        for switch in sorted(set(self.prefixes) | set(self.suffixes)):
+            lines.append(f'{switch}:')
+            for mask, routes in self.prefixes.get(switch, ()):
+                for network, (hop, hop_ip_address, priority) in sorted(routes.items()):
+                    lines.append(f'  {int_to_ip(network)}/{prefix_length(mask)} -> {hop} {hop_ip_address}')
+            for host_id, (hop, hop_ip_address, priority) in sorted(self.suffixes.get(switch, {}).items()):
+                lines.append(f'  *.*.*.{host_id} -> {hop} {hop_ip_address}')
+        return lines
+
+
+# Two-level routing tables of a fat-tree with k ports per switch, generated with integer arithmetic
+# on the addresses of topo.Fattree. node_ids maps every node address, as an int, to the node id.
+def fat_tree_routing_table(k, node_ids):
+    half = k // 2
+    table = TwoLevelTable()
+    routes = {}
+
+    def route(address, priority):
+        if (address, priority) not in routes:
+            routes[(address, priority)] = (node_ids[address], int_to_ip(address), priority)
+        return routes[(address, priority)]
+
+    # Core switches: one prefix per pod. The cores of row j reach the pods through the same
+    # aggregation switches and share their prefixes.
+    for j in range(1, half + 1):
+        pods = {ip_from_octets(10, pod, 0, 0): route(ip_from_octets(10, pod, j + half - 1, 1), 1) for pod in range(k)}
+        for i in range(1, half + 1):
+            table.add_bucket(node_ids[ip_from_octets(10, k, j, i)], MASK_16, pods)
+
+    # Aggregation switches: the subnets of the pod, shared within the pod, then the hosts spread over
+    # the core switches by suffix, shared with the switches at the same position in the other pods
+    suffixes = [{host_id: route(ip_from_octets(10, k, switch - half + 1, (host_id - 2 + switch) % half + 1), 1)
+                 for host_id in range(2, half + 2)}
+                for switch in range(half, k)]
+    for pod in range(k):
+        subnets = {ip_from_octets(10, pod, subnet, 0): route(ip_from_octets(10, pod, subnet, 1), 2)
+                   for subnet in range(half)}
+        for switch in range(half, k):
+            switch_id = node_ids[ip_from_octets(10, pod, switch, 1)]
+            table.add_bucket(switch_id, MASK_24, subnets)
+            table.suffixes[switch_id] = suffixes[switch - half]
+
+    # Edge switches: their own hosts, everything else up to an aggregation switch
+    for pod in range(k):
+        for i in range(half):
+            switch_id = node_ids[ip_from_octets(10, pod, i, 1)]
+            hosts = [ip_from_octets(10, pod, i, host_id) for host_id in range(2, half + 2)]
+            table.add_bucket(switch_id, MASK_32, {host: route(host, 1) for host in hosts})
+            table.add_bucket(switch_id, 0, {0: route(ip_from_octets(10, pod, i + half, 1), 1)})
+
+    return table
@@ -0,0 +1,106 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Compares the uplink choice of FTRouter by host id suffix with flow hashing (flow_hash_uplinks)
+# for the iperf flows of a Mininet CLI script such as performence.sh. Flows share the bandwidth
+# of the links they collide on, each flow is reported at its bottleneck fair share.
+
+import argparse
+import contextlib
+import os
+import random
+import re
+from collections import Counter
+
+import topo
+import two_level_routing
+
+# Link bandwidth of fat-tree.py in Mbit/s
+LINK_BW = 15
+
+
+def parse_flows(script):
+    with open(script) as f:
+        return re.findall(r'^(sv\d+) iperf -c (sv\d+)', f.read(), re.MULTILINE)
+
+
+# Switch-to-switch links a flow crosses; pick_uplink chooses the uplink when hashing, None follows the table
+def flow_path(table, nodes, src, dst, pick_uplink=None):
+    destination = two_level_routing.ip_to_int(nodes[dst].ip_address)
+    current = nodes[src].edges[0].left_node
+    links = []
+    while True:
+        hop = table.lookup(current.id, destination)[0]
+        uplinks = [node.id for node in topo.uplink_neighbours(current)] if current.type != 'Switch Level 1' else []
+        if pick_uplink is not None and hop in uplinks:
+            hop = pick_uplink(uplinks)
+        if hop == dst:
+            return links
+        links.append((current.id, hop))
+        current = nodes[hop]
+
+
+def flow_throughputs(paths):
+    load = Counter(link for path in paths for link in path)
+    throughputs = [min([LINK_BW / load[link] for link in path] + [LINK_BW]) for path in paths]
+    return throughputs, max(load.values(), default=0)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare suffix and flow-hash uplink selection of FTRouter')
+
+    parser.add_argument('-s', '--script', dest='script', default='performence.sh',
+                        help='Mininet CLI script with the iperf flows')
+
+    parser.add_argument('-k', '--ports', dest='ports', type=int, default=4,
+                        help='Number of ports per switch of the fat-tree')
+
+    parser.add_argument('-t', '--trials', dest='trials', type=int, default=10000,
+                        help='Random hash outcomes to average over')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        ft_topo = topo.Fattree(args.ports)
+    all_nodes = ft_topo.servers + ft_topo.core_switches + ft_topo.agg_switches + ft_topo.edge_switches
+    nodes = {node.id: node for node in all_nodes}
+    node_ids = {two_level_routing.ip_to_int(node.ip_address): node.id for node in all_nodes}
+    table = two_level_routing.fat_tree_routing_table(args.ports, node_ids)
+    flows = parse_flows(args.script)
+
+    suffix_paths = [flow_path(table, nodes, src, dst) for src, dst in flows]
+    suffix_throughputs, suffix_max_load = flow_throughputs(suffix_paths)
+    print(f'{len(flows)} flows from {args.script}')
+    print(f'Suffix routing: {sum(suffix_throughputs) / len(flows):.2f} Mbit/s per flow, '
+          f'{sum(suffix_throughputs):.2f} Mbit/s in total, at most {suffix_max_load} flows on a link')
+
+    rand = random.Random(0)
+    total_throughput = 0
+    max_loads = Counter()
+    for _ in range(args.trials):
+        hash_paths = [flow_path(table, nodes, src, dst, rand.choice) for src, dst in flows]
+        throughputs, max_load = flow_throughputs(hash_paths)
+        total_throughput += sum(throughputs)
+        max_loads[max_load] += 1
+
+    print(f'Flow hashing:   {total_throughput / args.trials / len(flows):.2f} Mbit/s per flow, '
+          f'{total_throughput / args.trials:.2f} Mbit/s in total on average over {args.trials} hash outcomes')
+    for max_load, count in sorted(max_loads.items()):
+        print(f'  at most {max_load} flows on a link in {count / args.trials * 100:.1f}% of the outcomes')
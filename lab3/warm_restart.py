@@ -0,0 +1,188 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Warm restart of the controllers. With state_file set, an app writes what it has learned (MAC
+# tables, destination MACs, down links) and the shadow flow tables of the FlowModBatcher to the file
+# every state_snapshot_interval seconds and when it stops, as gzipped JSON, and reads them back when
+# it starts.
+#
+# A switch that connects is asked for its flow table before anything else is sent to it. If it kept
+# entries through the restart they are taken over as its shadow table and left alone, entries of the
+# file it no longer has expired or were deleted after the file was written. If it comes back with
+# an empty table, it gets the entries of the file back instead of sending every flow to the
+# controller again. Groups are installed when the switch connects, as without a state file.
+#
+# Entries with a timeout leave the shadow tables when the switch reports them removed. Kept entries
+# with a timeout that were not installed with OFPFF_SEND_FLOW_REM are not taken over, their removal
+# would go unnoticed. Saved entries that timed out while the controller was down are installed
+# again and time out once more.
+
+# !/usr/bin/env python3
+import gzip
+import json
+import os
+import time
+
+from ryu.lib import hub
+from ryu.ofproto import ofproto_parser
+
+from routing_config import CONF
+from flow_mods import entry_key
+from workers import WorkerPool
+
+
+class WarmRestart:
+    # name tells apart the files of the apps, flow_mods is the FlowModBatcher of the app, event_log its
+    # event_log.EventLog and get_state returns the learned state of the app as a JSON-able dict
+    def __init__(self, name, flow_mods, event_log, get_state):
+        self.name = name
+        self.flow_mods = flow_mods
+        self.event_log = event_log
+        self.get_state = get_state
+        self.path = CONF.routing.state_file
+        # Learned state of the app read from the file, None without one
+        self.state = None
+        # dpid -> add flow-mods of the file, as JSON dicts, for switches that did not connect yet
+        self.saved = {}
+        # dpid -> (xid of the flow stats request, entries to reconcile, stats received so far)
+        self.pending = {}
+        self.workers = WorkerPool('state')
+        self.snapshot_thread = None
+        if not self.path:
+            return
+
+        self.flow_mods.installed = {}
+        self.load()
+        if CONF.routing.state_snapshot_interval > 0:
+            self.snapshot_thread = hub.spawn(self._snapshot)
+
+    def load(self):
+        try:
+            snapshot = read_state_file(self.path)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.event_log.warning('state_unreadable', 'file=%s error=%s starting without it', self.path, e)
+            return
+        if snapshot.get('app') != self.name:
+            self.event_log.warning('state_unreadable', 'file=%s app=%s starting without it', self.path,
+                                   snapshot.get('app'))
+            return
+        self.state = snapshot['state']
+        self.saved = {int(dpid): flows for dpid, flows in snapshot['flows'].items()}
+        self.event_log.info('state_loaded', 'file=%s age=%.0fs switches=%d flows=%d', self.path,
+                            time.time() - snapshot['time'], len(self.saved),
+                            sum(len(flows) for flows in self.saved.values()))
+
+    def _snapshot(self):
+        while True:
+            hub.sleep(CONF.routing.state_snapshot_interval)
+            self.workers.submit(write_state_file, (self.path, self.snapshot()))
+
+    # State of the app and flow-mods of every switch. The flow-mods are turned into JSON dicts here,
+    # they are changed by the handlers.
+    def snapshot(self):
+        flows = {str(dpid): flows for dpid, flows in self.saved.items()}
+        for dpid, (_, entries, _) in self.pending.items():
+            flows[str(dpid)] = [msg.to_jsondict() for msg in entries.values()]
+        for dpid, entries in self.flow_mods.installed.items():
+            if dpid not in self.pending:
+                flows[str(dpid)] = [msg.to_jsondict() for msg in entries.values()]
+        return {'app': self.name, 'time': time.time(), 'state': self.get_state(), 'flows': flows}
+
+    # Write the file now, for when the app stops
+    def save(self):
+        if self.path:
+            write_state_file(self.path, self.snapshot())
+            self.event_log.info('state_saved', 'file=%s', self.path)
+
+    # Ask a switch that connects for its flow table. Goes out before the entries the app installs on
+    # connect, so that the reply shows what the switch kept.
+    def switch_connected(self, datapath):
+        if not self.path:
+            return
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        entries = self.flow_mods.installed.pop(datapath.id, None)
+        if entries is None:
+            entries = {}
+            for jsondict in self.saved.pop(datapath.id, ()):
+                msg = ofproto_parser.ofp_msg_from_jsondict(datapath, jsondict)
+                entries[entry_key(msg.table_id, msg.priority, msg.match)] = msg
+
+        request = parser.OFPFlowStatsRequest(datapath, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY, ofproto.OFPG_ANY)
+        datapath.set_xid(request)
+        self.pending[datapath.id] = (request.xid, entries, [])
+        self.flow_mods.send(datapath, request)
+
+    # Collect the replies to switch_connected, other apps ask for flow stats as well
+    def flow_stats_reply(self, msg):
+        datapath = msg.datapath
+        pending = self.pending.get(datapath.id)
+        if pending is None or pending[0] != msg.xid:
+            return
+        pending[2].extend(msg.body)
+        if msg.flags & datapath.ofproto.OFPMPF_REPLY_MORE:
+            return
+        del self.pending[datapath.id]
+        self.reconcile(datapath, pending[1], pending[2])
+
+    # An entry timed out on the switch, it also leaves the entries the switch is being reconciled with
+    def flow_removed(self, msg):
+        self.flow_mods.removed(msg)
+        pending = self.pending.get(msg.datapath.id)
+        if pending is not None:
+            pending[1].pop(entry_key(msg.table_id, msg.priority, msg.match), None)
+
+    # Take over the entries a switch kept, or install the saved ones on a switch that kept none. The
+    # table-miss entries do not count, the app installs them again on connect.
+    def reconcile(self, datapath, entries, stats):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        installed = self.flow_mods.installed.setdefault(datapath.id, {})
+        kept = [stat for stat in stats if stat.priority > 0]
+        if kept:
+            for stat in kept:
+                if (stat.idle_timeout or stat.hard_timeout) and not stat.flags & ofproto.OFPFF_SEND_FLOW_REM:
+                    continue
+                installed.setdefault(entry_key(stat.table_id, stat.priority, stat.match), parser.OFPFlowMod(
+                    datapath=datapath, cookie=stat.cookie, table_id=stat.table_id, idle_timeout=stat.idle_timeout,
+                    hard_timeout=stat.hard_timeout, priority=stat.priority, flags=stat.flags, match=stat.match,
+                    instructions=stat.instructions))
+            self.event_log.info('flows_kept', 'switch=%s flows=%d saved=%d', datapath.id, len(kept), len(entries))
+            return
+
+        restored = 0
+        for key, msg in entries.items():
+            if key not in installed:
+                msg.xid = None
+                self.flow_mods.send(datapath, msg)
+                restored += 1
+        self.event_log.info('flows_restored', 'switch=%s flows=%d', datapath.id, restored)
+
+
+# Read a file of write_state_file
+def read_state_file(path):
+    with gzip.open(path, 'rt') as f:
+        return json.load(f)
+
+
+# Write the snapshot to a temporary file first, a restart never reads a half-written one
+def write_state_file(path, snapshot):
+    with gzip.open(path + '.tmp', 'wt') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+    os.replace(path + '.tmp', path)
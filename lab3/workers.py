@@ -0,0 +1,156 @@
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Work the controllers move off the event loop. ryu-manager runs every handler on one eventlet
+# hub, so a route recomputation in a handler holds up every packet-in behind it.
+#
+# WorkerPool runs functions on the native threads of eventlet.tpool, ryu-manager patches threading
+# into green threads that would hold the hub just the same. The functions must only read data
+# nobody changes while they run, the apps hand them copies. A green thread per job waits for the
+# result and runs the callback on the hub like any handler, or the errback with the exception when
+# the function raised. At most worker_threads jobs of a pool
+# run at once, once worker_queue_size jobs are waiting the pool runs new ones inline, which keeps
+# the backlog bounded.
+#
+# LoopMetrics records how long the packet-in handler takes and how many events wait in the queue
+# of the app, and reports the counters of the flow_mods.FlowModBatcher and event_log.EventLog of the
+# app. With loop_metrics_interval set it also samples the lag of the hub, how much later than asked
+# a green thread wakes up, which is what a blocking handler adds to every packet-in waiting behind
+# it, and logs a summary every loop_metrics_interval seconds.
+
+# !/usr/bin/env python3
+import collections
+import time
+
+from eventlet import tpool
+from ryu.lib import hub
+
+from routing_config import CONF
+from event_log import EventLog
+
+# Packet-in latencies, queue depths and hub lags kept for the percentiles
+METRICS_HISTORY = 1000
+
+# Seconds between two samples of the hub lag
+LAG_INTERVAL = 0.01
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+class WorkerPool:
+    def __init__(self, name, num_threads=None, max_pending=None):
+        self.name = name
+        self.num_threads = CONF.routing.worker_threads if num_threads is None else num_threads
+        self.max_pending = CONF.routing.worker_queue_size if max_pending is None else max_pending
+        self.pending = 0
+        self.completed = 0
+        self.inline = 0
+        self.event_log = EventLog('WorkerPool')
+        self.slots = hub.BoundedSemaphore(max(self.num_threads, 1))
+
+    # Run fn(*args) on a worker and callback(result), if given, on the hub once it is done. If fn
+    # raises, errback(exception) is called instead.
+    def submit(self, fn, args, callback=None, errback=None):
+        if self.num_threads <= 0 or self.pending >= self.num_threads + self.max_pending:
+            self.inline += 1
+            try:
+                result = fn(*args)
+            except Exception as e:
+                self._failed(e, errback)
+                return
+            if callback is not None:
+                callback(result)
+            return
+        self.pending += 1
+        hub.spawn(self._run, fn, args, callback, errback)
+
+    def _run(self, fn, args, callback, errback):
+        try:
+            with self.slots:
+                result = tpool.execute(fn, *args)
+        except Exception as e:
+            self._failed(e, errback)
+            return
+        finally:
+            self.pending -= 1
+            self.completed += 1
+        if callback is not None:
+            callback(result)
+
+    def _failed(self, error, errback):
+        self.event_log.warning('job_failed', 'pool=%s error=%r', self.name, error)
+        if errback is not None:
+            errback(error)
+
+
+class LoopMetrics:
+    def __init__(self, app, pools=(), flow_mods=None, event_log=None):
+        self.app = app
+        self.pools = list(pools)
+        self.flow_mods = flow_mods
+        self.event_log = event_log or EventLog('LoopMetrics')
+        self.latencies = collections.deque(maxlen=METRICS_HISTORY)
+        self.queue_depths = collections.deque(maxlen=METRICS_HISTORY)
+        self.lags = collections.deque(maxlen=METRICS_HISTORY)
+        self.packet_ins = 0
+        if CONF.routing.loop_metrics_interval > 0:
+            self.lag_thread = hub.spawn(self._sample_lag)
+            self.report_thread = hub.spawn(self._report)
+
+    # Record a packet-in handled since start, a time.perf_counter() value
+    def packet_in(self, start):
+        self.latencies.append(time.perf_counter() - start)
+        self.queue_depths.append(self.app.events.qsize())
+        self.packet_ins += 1
+
+    def summary(self):
+        summary = {
+            'packet_ins': self.packet_ins,
+            'event_queue_depth': self.app.events.qsize(),
+            'max_event_queue_depth': max(self.queue_depths, default=0),
+        }
+        for name, fraction in (('p50', 0.5), ('p99', 0.99), ('max', 1.0)):
+            summary[f'packet_in_{name}_ms'] = percentile(self.latencies, fraction) * 1000
+        for name, fraction in (('p99', 0.99), ('max', 1.0)):
+            summary[f'hub_lag_{name}_ms'] = percentile(self.lags, fraction) * 1000
+        for pool in self.pools:
+            summary[f'{pool.name}_pending'] = pool.pending
+            summary[f'{pool.name}_completed'] = pool.completed
+            summary[f'{pool.name}_inline'] = pool.inline
+        if self.flow_mods is not None:
+            for name, count in sorted(self.flow_mods.counters.items()):
+                summary[f'sent_{name}'] = count
+        summary.update(self.event_log.summary())
+        return summary
+
+    def _sample_lag(self):
+        while True:
+            start = time.perf_counter()
+            hub.sleep(LAG_INTERVAL)
+            self.lags.append(max(time.perf_counter() - start - LAG_INTERVAL, 0.0))
+
+    def _report(self):
+        while True:
+            hub.sleep(CONF.routing.loop_metrics_interval)
+            summary = ' '.join(f'{key}={value:.3f}' if isinstance(value, float) else f'{key}={value}'
+                               for key, value in self.summary().items())
+            self.event_log.info('loop_metrics', '%s', summary)